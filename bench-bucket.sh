@@ -0,0 +1,15 @@
+#!/bin/bash
+
+# Compare the python and numpy bucketing engines on a synthetic analyse.py output
+
+ROWS=${ROWS:-2000000}
+
+mkdir -p results
+
+src/synth.py -n $ROWS -a > results/bench-bucket-2.csv
+
+for engine in python numpy; do
+    src/peakmem.py "bucket.py -e $engine" src/bucket.py -e $engine -n -c -p -s 0.1 results/bench-bucket-2.csv > results/bench-bucket-3-$engine.csv
+done
+
+cmp results/bench-bucket-3-python.csv results/bench-bucket-3-numpy.csv && echo 'Engines agree'
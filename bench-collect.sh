@@ -0,0 +1,10 @@
+#!/bin/bash
+
+# Overhead and detection delay of collect.py in each scenario, against a
+# local mock of the FT API, appended to results/bench-collect.jsonl
+
+DURATION=${DURATION:-60}
+
+mkdir -p results
+
+src/bench.py -d $DURATION -o results/bench-collect.jsonl "$@"
@@ -0,0 +1,23 @@
+#!/bin/bash
+
+# Peak memory of analyse.py and bucket.py on a synthetic 10M row collection,
+# and of analyse.py on one with many uuids whose articles have bodies the
+# size of real ones
+
+ROWS=${ROWS:-10000000}
+ITEM_ROWS=${ITEM_ROWS:-1000000}
+ITEM_UUIDS=${ITEM_UUIDS:-100000}
+BODY_SIZE=${BODY_SIZE:-4000}
+
+mkdir -p results
+
+src/synth.py -n $ROWS -C sqlite:results/bench-cache.db > results/bench-1.csv
+src/synth.py -n $ROWS -a > results/bench-2.csv
+
+src/peakmem.py 'analyse.py' src/analyse.py -C sqlite:results/bench-cache.db -b first_appearance results/bench-1.csv > /dev/null
+src/peakmem.py 'analyse.py --stream' src/analyse.py -C sqlite:results/bench-cache.db -b first_appearance --stream results/bench-1.csv > /dev/null
+src/peakmem.py 'bucket.py' src/bucket.py -n -c -p -s 0.1 results/bench-2.csv > /dev/null
+
+src/synth.py -n $ITEM_ROWS -u $ITEM_UUIDS -B $BODY_SIZE -C sqlite:results/bench-items-cache.db > results/bench-items.csv
+
+src/peakmem.py "analyse.py ($ITEM_UUIDS uuids)" src/analyse.py -C sqlite:results/bench-items-cache.db -b first_appearance results/bench-items.csv > /dev/null
@@ -3,33 +3,58 @@
 
 import logging
 import json
-import urllib.request, urllib.parse, urllib.error
-import datetime
-import time
 import sys
 import csv
+import array
+import collections
 import os
+import pickle
+import shutil
+import tempfile
+import heapq
+import multiprocessing
+import zlib
 import re
 import argparse
 import ftapi
+import ftcache
+import columnar
+import timeparse
+import mentions
+import metadata
+import content
+import profiling
+import checkpoint
+import downsample
+from content import Item
 import pygal
 import math
 
 UUID_LENGTH = 36
 UUID_REGEX = re.compile('([0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12})')
 
-DATE_REGEX = re.compile('([0-9]{4}).([0-9]{2}).([0-9]{2}).([0-9]{2}).([0-9]{2}).([0-9]{2}).([0-9]+)')
-
 parser = argparse.ArgumentParser(description="Discover the article types and ages for articles collected by collect.py")
 
 parser.add_argument('csv', type=str, help='Input CSV file')
 parser.add_argument('-b', '--base', type=str, help='Calculate intervals relative to which point', choices=['published_date', 'first_appearance', 'first_external_mention'], default='published_date')
-parser.add_argument('-m', '--mention-file', type=str, help='Log file to look for mentions (use with -b first_external_mention)')
+parser.add_argument('-m', '--mention-file', type=str, action='append', help='Log file to look for mentions, may be gzipped and given more than once (use with -b first_external_mention)')
+parser.add_argument('-M', '--mention-index', type=str, help='Save the first mention of each uuid to this file, and reuse it while the mention files are unchanged')
 parser.add_argument('-z', '--zeroes', action='store_true', help='Include results with zero interval (default: discard these)')
 parser.add_argument('-p', '--poll-interval', type=int, help='Seconds to sleep between collecting', default=1)
+parser.add_argument('-r', '--rate', type=float, help='Maximum requests per second for uncached articles (default: 1/poll interval)', default=None)
+parser.add_argument('-j', '--jobs', type=int, help='Number of articles to fetch concurrently (default: 8)', default=8)
 parser.add_argument('-k', '--key', type=str, help='FT API key (default: ~/.ft_api_key)', default=None)
-parser.add_argument('-C', '--cache', type=str, help='Cache directory for article responses', default=None)
+parser.add_argument('-C', '--cache', type=str, help='Cache for article responses: a directory, or sqlite:<file> for a single-file cache, optionally followed by ?<option>=<value>&...', default=None)
+parser.add_argument('-D', '--metadata', type=str, help='SQLite file to keep what each uuid resolved to in, so that its article is only fetched and parsed once', default=None)
 parser.add_argument('-g', '--graph', type=str, help='Render SVG graph to this file')
+parser.add_argument('--graph-points', type=int, help='Most points to draw for each group in the graph, binning results that are close together into one larger point (default: 2000, 0 for all)', default=2000)
+parser.add_argument('-f', '--format', type=str, help='Input format, CSV or binary columnar from collect.py --output-format binary (default: csv)', choices=['csv', 'binary'], default='csv')
+parser.add_argument('--output-format', type=str, help='Write results as CSV or in the binary columnar format (default: csv)', choices=['csv', 'binary'], default='csv')
+parser.add_argument('-S', '--stream', action='store_true', help='Write results as the input is read, in input order rather than by uuid, keeping only per-uuid state in memory (cannot be used with -g)')
+parser.add_argument('--checkpoint', type=str, help='Save what has been read of the input to this file, and on later runs read only the rows added since, writing only their results (implies --stream, CSV input only)', default=None)
+parser.add_argument('-w', '--workers', type=int, help='Share the uuids between this many processes, by hash (default: 1)', default=1)
+parser.add_argument('--profile', action='store_true', help='Time each stage and count the memory it allocates, and write a breakdown to stderr at the end')
+parser.add_argument('--profile-output', type=str, help='Also save cProfile statistics for pstats to this file (implies --profile)', default=None)
 parser.add_argument('--debug', type=str, help='Set log level (default:WARN)', default=None)
 
 args = parser.parse_args()
@@ -39,20 +64,45 @@ if args.debug:
 else:
     logging.root.setLevel(logging.WARN)
 
+if args.profile or args.profile_output:
+    profiling.enable(args.profile_output)
+    timeparse.parse_iso = profiling.timed('timestamps', timeparse.parse_iso)
+    Item.get_content = staticmethod(profiling.timed('article cache', Item.get_content))
+    Item.__init__ = profiling.timed('article JSON', Item.__init__)
+
 if not args.key:
     try:
         args.key = open(os.path.expanduser('~/.ft_api_key'),'r').read().strip()
     except IOError:
         args.key = None
 
-mentions={}
+first_mentions = {}
 if args.mention_file:
-    for line in open( args.mention_file,'r' ).readlines():
-        for match in UUID_REGEX.findall(line):
-            uuid = match.lower()
-            if uuid not in mentions:
-                mentions[uuid]=[]
-            mentions[uuid].append(line.strip())
+    with profiling.stage('mentions'):
+        first_mentions = mentions.first_mentions(args.mention_file, args.mention_index)
+
+if args.output_format == 'binary':
+    BINARY_OUT = columnar.ColumnWriter(sys.stdout.buffer, columnar.ANALYSE_SCHEMA)
+else:
+    BINARY_OUT = None
+
+if args.checkpoint:
+    if args.graph:
+        parser.error('--checkpoint cannot be used with --graph')
+    if args.format != 'csv':
+        parser.error('--checkpoint needs CSV input')
+    if args.workers > 1:
+        parser.error('--checkpoint cannot be used with --workers')
+    args.stream = True
+
+if args.stream and args.graph:
+    parser.error('--stream cannot be used with --graph')
+
+if args.workers < 1:
+    parser.error('--workers must be at least 1')
+
+if args.rate is None:
+    args.rate = args.poll_interval and 1.0/args.poll_interval
 
 if args.base == 'first_external_mention' and not args.mention_file:
     raise Exception('No file supplied for external mentions: expected -m <filename>')
@@ -69,153 +119,367 @@ def really_dump(o):
 def json_dump(o, **args):
     return json.dumps(o, default=really_dump, **args)
 
-class Item:
-    KEY = args.key
-    CACHE = args.cache
-    THROTTLE_INTERVAL = args.poll_interval
-
-    def __init__(self, id=None):
-        self._id = id
-        _json = Item.get_content(self._id)
-        self._obj = json.loads(_json)
-        self.origin = self.sniff_origin()
-        self.type = self._obj.get('type', None)
-        self.title = self._obj.get('title', None) or self._obj.get('description', None)
-        #logging.debug( json_dump(self._obj, indent=4) )
-        self.published_date = datetime.datetime.strptime(self._obj['publishedDate'][:26], "%Y-%m-%dT%H:%M:%S.%fZ")
-
-    def sniff_origin(self):
-        if 'webUrl' in self._obj:
-            if 'www.ft.com/cms' in self._obj['webUrl']:
-                return 'METHODE'
-            elif 'blogs.ft.com/' in self._obj['webUrl']:
-                return 'BLOGS'
-            elif 'www.ft.com/fastft' in self._obj['webUrl']:
-                return 'FASTFT'
-        return 'UNKNOWN'
-
-    def __hash__(self):
-        return id(self)
-                
-    def __str__(self):
-        return '<%s %s "%s">' % (self.origin, Item.str_type(self.type), self.title)
-                   
-    CONTENT_URL = "http://api.ft.com/content"
-    ONTOLOGY_URL = "http://www.ft.com/ontology/content"
-
-    @staticmethod
-    def get_content(i_d):
-        i_d = i_d[-UUID_LENGTH:] # get rid of any http:// prefix
-        try:
-            return ftapi.CachingFTURLopener(throttle=Item.THROTTLE_INTERVAL,cache=Item.CACHE,cache_errors=True).get_url( Item.CONTENT_URL+"/"+i_d, key=Item.KEY)
-        except urllib.error.HTTPError as e:
-            raise ValueError('No content')
-
-    @staticmethod
-    def str_type(type):
-        if type.startswith(Item.ONTOLOGY_URL):
-            return type[len(Item.ONTOLOGY_URL)+1:]
-        else:
-            return type
-
-
-data = csv.reader( open( args.csv, 'r').readlines() )
-
-uuids = {}
-not_content = set()
-
-for line in list(data):
-    when = datetime.datetime.strptime(line[0], "%Y-%m-%dT%H:%M:%S.%fZ")
-    src = line[1]
-    line_uuids = []
-    line_extras = []
+Item.KEY = args.key
+Item.CACHE = args.cache
+Item.RATE_LIMITER = ftapi.TokenBucket(args.rate)
+
+# with --workers, each worker opens its own
+METADATA = None
+if args.metadata:
+    # what didn't resolve is kept in the metadata store rather than the cache
+    Item.CACHE_ERRORS = False
+    if args.workers == 1:
+        METADATA = metadata.MetadataStore(args.metadata)
+
+# with --checkpoint, where the last run stopped reading and the first
+# time it saw each uuid
+CHECKPOINT = None
+FIRST_SEEN = {}
+if args.checkpoint:
+    try:
+        CHECKPOINT = checkpoint.Checkpoint(args.checkpoint, { 'csv': os.path.abspath(args.csv),
+                                                              'base': args.base,
+                                                              'zeroes': args.zeroes,
+                                                              'output_format': args.output_format })
+        SPAN = CHECKPOINT.span(args.csv)
+    except ValueError as e:
+        parser.error(str(e))
+    if CHECKPOINT.state is not None:
+        FIRST_SEEN = CHECKPOINT.state
+
+def open_csv(filename):
+    if CHECKPOINT:
+        return checkpoint.read_lines(filename, *SPAN)
+    return open(filename, 'r')
+
+# uuid -> whether this worker's shard has it, as each is seen many times
+SHARDS = {}
+
+def in_shard(uuid):
+    if SHARD is None:
+        return True
+    owned = SHARDS.get(uuid)
+    if owned is None:
+        owned = SHARDS[uuid] = zlib.crc32(uuid.encode('utf-8')) % args.workers == SHARD
+    return owned
+
+def has_shard_uuid(line):
     for field in line[2:]:
-        # the old version had multiple uuids per line, this was quite a bad idea
-        # but the 3 week data set does it this way.
-        # Therefore, spot UUIDs in fields and collect other fields into 'extras'
-        # FIXME: remove support for the old data set
-        if len(field)==UUID_LENGTH:
-            line_uuids.append(field)
+        if len(field)==UUID_LENGTH and in_shard(field):
+            return True
+    return False
+
+def read_rows(filename):
+    # yields the number of each row along with it, counting rows in other
+    # shards, which are skipped before their timestamps are parsed
+    if args.format == 'binary':
+        for row,(when,src,uuid,status,latency) in enumerate(columnar.read_rows(filename, columnar.COLLECT_SCHEMA)):
+            if in_shard(uuid):
+                yield row,when,src,[uuid],[status]
+        return
+
+    for row,line in enumerate(csv.reader( open_csv(filename) )):
+        if SHARD is not None and not has_shard_uuid(line):
+            continue
+        when = timeparse.parse_iso(line[0])
+        src = line[1]
+        line_uuids = []
+        line_extras = []
+        fields = line[2:]
+        if len(line) == 5 and len(line[2]) == UUID_LENGTH and len(line[3]) != UUID_LENGTH:
+            # <time>,<url_name>,<uuid>,<status>,<latency> as collect.py writes
+            # poll lines: the fetch latency is not an extra
+            fields = line[2:4]
+        for field in fields:
+            # the old version had multiple uuids per line, this was quite a bad idea
+            # but the 3 week data set does it this way.
+            # Therefore, spot UUIDs in fields and collect other fields into 'extras'
+            # FIXME: remove support for the old data set
+            if len(field)==UUID_LENGTH:
+                line_uuids.append(field)
+            else:
+                line_extras.append(field)
+        yield row,when,src,line_uuids,line_extras
+
+def read_ids(filename):
+    ids = collections.OrderedDict()
+    if args.format == 'binary':
+        for chunk in columnar.read_chunks(filename):
+            codes, dictionary = chunk['uuid']
+            for uuid in dictionary:
+                if in_shard(uuid):
+                    ids[uuid] = True
+        return ids
+
+    for line in csv.reader( open_csv(filename) ):
+        for field in line[2:]:
+            if len(field)==UUID_LENGTH and in_shard(field):
+                ids[field] = True
+    return ids
+
+DAY = timeparse.DAY
+
+write_line = print
+
+def emit(uuid, src, item, interval, extras):
+    if BINARY_OUT:
+        BINARY_OUT.write( (uuid, src, item.origin, timeparse.interval_seconds(interval), ','.join(extras), item.title) )
+        return
+
+    safe_title = item.title.replace('"',r'\"')
+    if interval < 0:
+        # str(negative-interval) is unhelpful
+        write_line('%s,%s,%s,-%s,%s,"%s"' % (uuid,src,item.origin,timeparse.format_interval(-interval),','.join(extras),safe_title))
+    else:
+        write_line('%s,%s,%s,%s,%s,"%s"' % (uuid,src,item.origin,timeparse.format_interval(interval),','.join(extras),safe_title))
+
+emit = profiling.timed('output', emit)
+
+def report(uuid, item, first_when, when, src, extras):
+    # prints the result line for one observation, returning its group and
+    # the interval if it should be kept for the graph
+    interval = None
+
+    if args.base == 'first_appearance':
+        interval = when - first_when
+    elif args.base == 'first_external_mention':
+        if uuid not in first_mentions:
+            logging.debug('No mentions of %s, discarding' % uuid)
         else:
-            line_extras.append(field)
-
-    for uuid in line_uuids:
-        if uuid not in not_content:
+            interval = when - first_mentions[uuid]
+    else:
+        interval = when - item.published_ts
+
+    if len(extras)>0:
+        group = str(extras[0])+':'+item.origin+':'+src
+    else:
+        group = '0'+':'+item.origin+':'+src
+
+    if interval is not None and interval < DAY:
+        if interval != 0 or args.zeroes:
+            emit(uuid, src, item, interval, extras)
+        return group, interval
+
+    return group, None
+
+
+class Codes(dict):
+    # numbers values in the order they are first seen
+    def __init__(self):
+        dict.__init__(self)
+        self.values = []
+
+    def code(self, value):
+        code = self.get(value)
+        if code is None:
+            code = self[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class ShardOutput:
+    # a worker's part of the output, as (key, record) pairs pickled to a file
+    # in batches, where the key says where the record goes in the output
+    def __init__(self, filename, batch_size=10000):
+        self.filename = filename
+        self.batch_size = batch_size
+        self.out = open(filename, 'wb')
+        self.batch = []
+        self.key = None
+
+    def write(self, record):
+        self.batch.append( (self.key, record) )
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            pickle.dump(self.batch, self.out, pickle.HIGHEST_PROTOCOL)
+            self.batch = []
+
+    def close(self):
+        self.flush()
+        self.out.close()
+
+def read_shard(filename):
+    with open(filename, 'rb') as f:
+        while True:
             try:
-                if uuid not in uuids:
-                    content = Item(id=uuid)
-                    logging.debug( 'Found %s' % content )
-                    uuids[uuid] = [content]
-                uuids[uuid].append( (when,src,line_extras) )
-            except ValueError as e:
-                logging.debug(e)
-                logging.info('%s was not content' % uuid)
-                not_content.add(uuid)
-
-DAY = datetime.timedelta(1,0,0)
+                batch = pickle.load(f)
+            except EOFError:
+                return
+            for pair in batch:
+                yield pair
+
+
+# the shard this process is working on, with --workers
+SHARD = None
+SHARD_OUT = None
 
 RESULTS = {}
 GROUPS = set()
 TITLES = {}
 
-for uuid,result in sorted(list(uuids.items())):
-    item = result[0]
-    TITLES[uuid] = item.title
-    RESULTS[uuid]={}
-
-    for when,src,extras in result[1:]:
-
-        interval = None
-
-        if args.base == 'first_appearance':
-            interval = when - result[1][0]
-        elif args.base == 'first_external_mention':
-            if uuid not in mentions:
-                logging.debug('No mentions of %s, discarding' % uuid)
-            else:
-                logging.debug('Finding first mention of %s' % uuid)
-                first_time = None
-                for line in mentions[uuid]:
-                    logging.debug(line)
-                    mention_time = DATE_REGEX.match(line)
-                    if not mention_time:
-                        logging.debug("Don't understand line %s" % uuid)
-                    else:
-                        this_time = datetime.datetime(int(mention_time.group(1)),
-                                        int(mention_time.group(2)),
-                                        int(mention_time.group(3)),
-                                        int(mention_time.group(4)),
-                                        int(mention_time.group(5)),
-                                        int(mention_time.group(6)),
-                                        int((mention_time.group(7)+'000000')[:6]))
-                        if first_time is None or this_time < first_time:
-                            first_time = this_time
-                interval = when - first_time
-        else:
-            interval = when - item.published_date
+def analyse_stream():
+    # two passes over the file, so memory depends on the number of uuids
+    # rather than the number of rows
+    with profiling.stage('read ids'):
+        ids = read_ids(args.csv)
+    with profiling.stage('resolve'):
+        items = content.resolve_items(ids, args.jobs, METADATA)
+
+    profiling.start('intervals')
+    for row,when,src,line_uuids,line_extras in profiling.timed_iter('read', read_rows(args.csv)):
+        for i,uuid in enumerate(line_uuids):
+            if not in_shard(uuid):
+                continue
+            if SHARD_OUT:
+                SHARD_OUT.key = (row, i)
+            if uuid not in FIRST_SEEN:
+                FIRST_SEEN[uuid] = when
+            item = items[uuid]
+            if item is not None:
+                report(uuid, item, FIRST_SEEN[uuid], when, src, line_extras)
+    profiling.stop()
+
+def analyse_batch():
+    # observations are kept in parallel typed arrays, with the uuid, source
+    # and extras of each as small-int codes, rather than as a tuple each
+    uuids = Codes()
+    sources = Codes()
+    extras = Codes()
+    whens = array.array('q')
+    uuid_codes = array.array('I')
+    src_codes = array.array('I')
+    extras_codes = array.array('I')
+
+    profiling.start('observations')
+    for row,when,src,line_uuids,line_extras in profiling.timed_iter('read', read_rows(args.csv)):
+        src_code = sources.code(src)
+        extras_code = extras.code(tuple(line_extras))
+        for uuid in line_uuids:
+            if not in_shard(uuid):
+                continue
+            whens.append(when)
+            uuid_codes.append(uuids.code(uuid))
+            src_codes.append(src_code)
+            extras_codes.append(extras_code)
+
+    profiling.stop()
+
+    with profiling.stage('resolve'):
+        items = content.resolve_items(uuids.values, args.jobs, METADATA)
+
+    # group the observations by uuid, keeping them in input order within
+    # each group (a counting sort on the uuid codes)
+    profiling.start('intervals')
+    counts = [0] * len(uuids.values)
+    for code in uuid_codes:
+        counts[code] += 1
+    starts = [0] * len(counts)
+    for code in range(1, len(counts)):
+        starts[code] = starts[code-1] + counts[code-1]
+    order = array.array('I', bytes(4 * len(uuid_codes)))
+    position = list(starts)
+    for i,code in enumerate(uuid_codes):
+        order[position[code]] = i
+        position[code] += 1
+
+    for code in sorted(range(len(uuids.values)), key=uuids.values.__getitem__):
+        uuid = uuids.values[code]
+        item = items[uuid]
+        if item is None:
+            continue
+        if SHARD_OUT:
+            SHARD_OUT.key = uuid
+        if args.graph:
+            TITLES[uuid] = item.title
+            RESULTS[uuid]={}
+
+        observed = order[starts[code]:starts[code]+counts[code]]
+        first_when = whens[observed[0]]
+        for i in observed:
+            group, interval = report(uuid, item, first_when, whens[i], sources.values[src_codes[i]],
+                                     extras.values[extras_codes[i]])
+            if not args.graph:
+                continue # the results are only kept for the graph
+            GROUPS.add(group)
+            if group not in RESULTS[uuid]:
+                RESULTS[uuid][group] = []
+            if interval is not None:
+                RESULTS[uuid][group].append( interval )
+    profiling.stop()
+
+
+def run_shard(shard):
+    # in a worker process, forked once everything else was set up: does
+    # what a serial run would for the uuids in its shard, saving its output
+    # to be merged
+    global SHARD, SHARD_OUT, BINARY_OUT, write_line, METADATA
+    SHARD = shard
+    SHARD_OUT = ShardOutput(os.path.join(SHARD_DIR, 'shard-%d' % shard))
+    if BINARY_OUT:
+        BINARY_OUT = SHARD_OUT
+    else:
+        write_line = SHARD_OUT.write
+    # the workers share the rate limit between them
+    Item.RATE_LIMITER = ftapi.TokenBucket(args.rate and args.rate / args.workers)
+    if args.metadata:
+        METADATA = metadata.MetadataStore(args.metadata)
+
+    if args.stream:
+        analyse_stream()
+    else:
+        analyse_batch()
+
+    SHARD_OUT.close()
+    if METADATA:
+        METADATA.close()
+    # pool workers leave by os._exit, without running atexit handlers, so
+    # whatever the caches have yet to write has to be written now
+    ftcache.close_caches()
+    return SHARD_OUT.filename, RESULTS, TITLES, GROUPS
+
+if args.workers > 1:
+    # each worker takes the uuids whose hash falls in its shard; as each
+    # uuid's output is only in one shard, merging the shards by the order
+    # each part of the output would have been written in gives the same
+    # output as a serial run
+    SHARD_DIR = tempfile.mkdtemp(prefix='analyse-')
+    # each worker opens the caches for itself, rather than sharing
+    # connections and file handles with this process
+    ftcache.close_caches()
+    try:
+        with multiprocessing.get_context('fork').Pool(args.workers) as pool:
+            shards = pool.map(run_shard, range(args.workers))
+        with profiling.stage('merge'):
+            for key, record in heapq.merge(*[read_shard(filename) for filename, _, _, _ in shards]):
+                if BINARY_OUT:
+                    BINARY_OUT.write(record)
+                else:
+                    write_line(record)
+        for filename, results, titles, groups in shards:
+            RESULTS.update(results)
+            TITLES.update(titles)
+            GROUPS.update(groups)
+    finally:
+        shutil.rmtree(SHARD_DIR)
+elif args.stream:
+    analyse_stream()
+else:
+    analyse_batch()
 
-        if len(extras)>0:
-            group = str(extras[0])+':'+item.origin+':'+src
-        else:
-            group = '0'+':'+item.origin+':'+src
-        GROUPS.add(group)
-        if group not in RESULTS[uuid]:
-            RESULTS[uuid][group] = []
-
-        if interval is not None and interval < DAY:
-            safe_title = item.title.replace('"',r'\"')
-            if interval > datetime.timedelta(0,0,0):
-                print('%s,%s,%s,%s,%s,"%s"' % (uuid,src,item.origin,interval,','.join(extras),safe_title))
-            elif interval == datetime.timedelta(0,0,0):
-                if args.zeroes:
-                    print('%s,%s,%s,%s,%s,"%s"' % (uuid,src,item.origin,interval,','.join(extras),safe_title))
-            else:
-                # str(negative-interval) is unhelpful
-                print('%s,%s,%s,-%s,%s,"%s"' % (uuid,src,item.origin,-interval,','.join(extras),safe_title))
+if BINARY_OUT:
+    with profiling.stage('output'):
+        BINARY_OUT.close()
 
-            RESULTS[uuid][group].append( interval )
+if CHECKPOINT:
+    # only once everything read has been written out
+    sys.stdout.flush()
+    CHECKPOINT.save(FIRST_SEEN)
 
 if args.graph:
+    profiling.start('graph')
     filter = re.compile('.+:METHODE')
 
     x = {}
@@ -235,15 +499,24 @@ if args.graph:
                 for interval in g[group]:
                     if uuid not in x:
                         x[uuid] = len(x)
-                    s = interval.days*86400+interval.seconds+interval.microseconds*0.000001
+                    s = interval / timeparse.SECOND
                     if s>0:
                         r.append( (x[uuid] + (i+1)*(1.0/(len(my_groups)+2)), s) )
 
         if r:
-            xy.add(group,r)
+            points = []
+            for px, py, count in downsample.density(r, args.graph_points):
+                if count == 1:
+                    points.append( (px, py) )
+                else:
+                    points.append( {'value': (px, py),
+                                    'node': {'r': 1.5*(1 + math.log10(count))},
+                                    'label': '%d results' % count} )
+            xy.add(group,points)
 
     logging.info('x-values for graph are:')
     for uuid in sorted(list(x.keys())):
         logging.info('%s = %s : %s' % (uuid,x[uuid],TITLES[uuid]))
 
     xy.render_to_file(args.graph)
+    profiling.stop()
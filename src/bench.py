@@ -0,0 +1,239 @@
+#!/usr/bin/python3
+#coding: utf-8
+
+import logging
+import argparse
+import csv
+import json
+import os
+import select
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeparse
+
+# Runs collect.py against mockapi.py in each scenario and reports how much
+# the collection itself costs and how far behind the truth it was: probes
+# per second, event loop lag, how long after each article appeared at each
+# endpoint collect.py saw it there, and collect.py's CPU time and peak RSS.
+# Each scenario is reported as one line of JSON, so that runs can be kept
+# and compared.
+
+SRC = os.path.dirname(os.path.abspath(__file__))
+
+# mockapi.py and collect.py arguments for each scenario
+SCENARIOS = { 'poll': { 'mock': ['-r', '2'],
+                        'collect': ['-A', '-p', '5'] },
+              'stdin': { 'mock': ['-r', '2', '-P'],
+                         'collect': ['-I', '-A'] },
+              'stdin-burst': { 'mock': ['-r', '50', '-P', '-t', '5,50'],
+                               'collect': ['-I', '-A', '-P', '100'] },
+              'stdin-flap': { 'mock': ['-r', '2', '-P', '-f', '0.2,10'],
+                              'collect': ['-I', '-A'] } }
+
+parser = argparse.ArgumentParser(description="Benchmark collect.py against a local mock of the FT API")
+
+parser.add_argument('scenarios', type=str, nargs='*', help='Scenarios to run: %s (default: all)' % sorted(SCENARIOS))
+parser.add_argument('-d', '--duration', type=float, help='Seconds to publish articles for in each scenario (default: 60)', default=60)
+parser.add_argument('--settle', type=float, help='Seconds to carry on collecting after the last article is published (default: 30)', default=30)
+parser.add_argument('-s', '--seed', type=int, help='Random seed for mockapi.py (default: 1)', default=1)
+parser.add_argument('-o', '--output', type=str, help='Append results to this file rather than writing them to stdout', default=None)
+parser.add_argument('-K', '--keep', type=str, help="Keep each scenario's output, truth and statistics files in this directory", default=None)
+parser.add_argument('--debug', type=str, help='Set log level (default:WARN)', default=None)
+
+args = parser.parse_args()
+
+if args.debug:
+    logging.root.setLevel(getattr(logging,args.debug))
+else:
+    logging.root.setLevel(logging.WARN)
+
+for scenario in args.scenarios:
+    if scenario not in SCENARIOS:
+        parser.error('No scenario %s: expected one of %s' % (scenario, sorted(SCENARIOS)))
+if not args.scenarios:
+    args.scenarios = sorted(SCENARIOS)
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def wait_for_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except ConnectionError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+def wait(process, timeout):
+    # returns the resource usage of process, killing it if it takes longer
+    # than timeout seconds
+    deadline = time.time() + timeout
+    while True:
+        pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+        if pid:
+            if os.WIFEXITED(status):
+                process.returncode = os.WEXITSTATUS(status)
+            else:
+                process.returncode = -os.WTERMSIG(status)
+            return usage
+        if time.time() > deadline:
+            logging.warn('%s took too long, killing it' % process.args[1])
+            process.kill()
+            deadline = float('inf')
+        time.sleep(0.1)
+
+def relay_lines(source, destination, until):
+    with destination:
+        while time.time() < until:
+            ready, _, _ = select.select([source], [], [], max(until - time.time(), 0))
+            if ready:
+                data = os.read(source.fileno(), 65536)
+                if not data:
+                    break
+                destination.write(data)
+                destination.flush()
+
+def summarise(errors):
+    errors = sorted(errors)
+    if not errors:
+        return {}
+    return { 'p50_ms': errors[len(errors)//2],
+             'p90_ms': errors[int(len(errors)*0.9)],
+             'max_ms': errors[-1],
+             'mean_ms': sum(errors) / len(errors) }
+
+def detection(truth, output):
+    # how long after each article appeared somewhere collect.py saw it
+    # there, by endpoint: the notifications feeds and STDIN when it was
+    # first reported, and article endpoints when they first returned it
+    seen = {}
+    for line in csv.reader(open(output, 'r')):
+        when, url_name, uuid, status = line[:4]
+        if url_name == 'STDIN':
+            url_name = 'PUBLISHED'
+        if status in ('0', '200') and (uuid, url_name) not in seen:
+            seen[(uuid, url_name)] = timeparse.parse_iso(when)
+
+    by_endpoint = {}
+    for (uuid, url_name), appeared in truth.items():
+        if url_name not in by_endpoint:
+            by_endpoint[url_name] = { 'found': 0, 'missed': 0, 'errors': [] }
+        endpoint = by_endpoint[url_name]
+        if (uuid, url_name) in seen:
+            endpoint['found'] += 1
+            endpoint['errors'].append((seen[(uuid, url_name)] - appeared) / 1000.0)
+        else:
+            endpoint['missed'] += 1
+
+    report = {}
+    for url_name, endpoint in by_endpoint.items():
+        report[url_name] = dict(summarise(endpoint.pop('errors')), **endpoint)
+    return report
+
+def run(scenario, work):
+    spec = SCENARIOS[scenario]
+    port = free_port()
+    truth_file = os.path.join(work, '%s-truth.csv' % scenario)
+    output = os.path.join(work, '%s.csv' % scenario)
+    mock_stats = os.path.join(work, '%s-mock.json' % scenario)
+    collect_stats = os.path.join(work, '%s-collect.json' % scenario)
+
+    mock = subprocess.Popen([sys.executable, os.path.join(SRC, 'mockapi.py'), '-p', str(port), '-d', str(args.duration),
+                             '-s', str(args.seed), '-T', truth_file, '-S', mock_stats] + spec['mock'],
+                            stdout=subprocess.PIPE)
+    wait_for_port(port)
+
+    run_time = args.duration + args.settle
+    collect_args = [sys.executable, os.path.join(SRC, 'collect.py'), '--host-override', 'http://127.0.0.1:%d' % port,
+                    '-o', output, '--stats-file', collect_stats, '--stats-interval', '1'] + spec['collect']
+    if '-I' not in spec['collect']:
+        # polls end by themselves
+        poll_interval = float(spec['collect'][spec['collect'].index('-p') + 1])
+        collect_args += ['-n', str(int(run_time / poll_interval) + 1)]
+
+    start = time.time()
+    collect = subprocess.Popen(collect_args, stdin=subprocess.PIPE)
+    # the mock's publish log is passed on to collect.py until run_time is
+    # up, and then its input ends, which ends it while the mock still serves
+    relay = threading.Thread(target=relay_lines, args=(mock.stdout, collect.stdin, start + run_time), daemon=True)
+    relay.start()
+    collect_usage = wait(collect, run_time + 30)
+    wall = time.time() - start
+    mock.send_signal(signal.SIGTERM)
+    mock_usage = wait(mock, 10)
+
+    truth = {}
+    published = 0
+    for uuid, url_name, when in csv.reader(open(truth_file, 'r')):
+        truth[(uuid, url_name)] = timeparse.parse_iso(when)
+        if url_name == 'PUBLISHED':
+            published += 1
+    # in stdin mode the notifications feeds aren't read, and in poll mode
+    # nothing says when articles were published
+    ignored = ('-I' in spec['collect'] and ('API-V1', 'API-V2')) or ('PUBLISHED',)
+    truth = dict((key, when) for key, when in truth.items() if key[1] not in ignored)
+
+    probes = 0
+    for line in csv.reader(open(output, 'r')):
+        if line[3] != '0':
+            probes += 1
+
+    with open(collect_stats, 'r') as f:
+        stats = json.load(f)
+    with open(mock_stats, 'r') as f:
+        served = json.load(f)
+
+    return { 'scenario': scenario,
+             'time': timeparse.format_iso(timeparse.now_us()),
+             'duration': args.duration,
+             'settle': args.settle,
+             'seed': args.seed,
+             'published': published,
+             'exit': collect.returncode,
+             'wall_s': wall,
+             'cpu_s': collect_usage.ru_utime + collect_usage.ru_stime,
+             'max_rss_mb': collect_usage.ru_maxrss / 1024.0,
+             'mock_cpu_s': mock_usage.ru_utime + mock_usage.ru_stime,
+             'probes': probes,
+             'probes_per_s': probes / wall,
+             'requests_served': sum(endpoint['requests'] for endpoint in served.values()),
+             'loop': stats['loop'],
+             'scheduler': stats['scheduler'],
+             'detection': detection(truth, output) }
+
+
+work = args.keep or tempfile.mkdtemp(prefix='bench-collect-')
+if args.keep:
+    os.makedirs(work, exist_ok=True)
+out = (args.output and open(args.output, 'a')) or sys.stdout
+
+try:
+    for scenario in args.scenarios:
+        result = run(scenario, work)
+        out.write(json.dumps(result, sort_keys=True) + '\n')
+        out.flush()
+        sys.stderr.write('%s: %.1f probes/s, loop lag p99 %.1fms, CPU %.1fs (mock %.1fs), peak RSS %.1f MB\n' %
+                         (scenario, result['probes_per_s'], result['loop']['lag_ms_p99'], result['cpu_s'],
+                          result['mock_cpu_s'], result['max_rss_mb']))
+        for url_name, endpoint in sorted(result['detection'].items()):
+            sys.stderr.write('  %s: found %d, missed %d' % (url_name, endpoint['found'], endpoint['missed']))
+            if endpoint['found']:
+                sys.stderr.write(', behind by p50 %.0fms p90 %.0fms' % (endpoint['p50_ms'], endpoint['p90_ms']))
+            sys.stderr.write('\n')
+finally:
+    if not args.keep:
+        shutil.rmtree(work)
@@ -3,22 +3,39 @@
 
 import logging
 import csv
+import json
 import os,sys
-import re
 import argparse
 import math
+import columnar
+import profiling
+import checkpoint
+import downsample
+import timeparse
 import pygal
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 parser = argparse.ArgumentParser(description="Distribute results of analyse.py by age buckets")
 
-parser.add_argument('csv', type=str, help='Input CSV file')
+parser.add_argument('csv', type=str, nargs='+', help='Input CSV files, or summaries with -f summary')
+parser.add_argument('-f', '--format', type=str, help='Input format, CSV or binary columnar from analyse.py --output-format binary, or summaries from --summary to merge (default: csv)', choices=['csv', 'binary', 'summary'], default='csv')
 parser.add_argument('-s', '--bucket-size', type=float, help='Bucket size in seconds', default=5)
 parser.add_argument('-l', '--limit', type=int, help='Maximum number of buckets (default:all)', default=0)
 parser.add_argument('-n', '--not-found', action='store_true', help='Include lines with 4xx status (default: exclude)')
 parser.add_argument('-c', '--cumulative', action='store_true', help='Report accumulation of values')
 parser.add_argument('-p', '--percentage', action='store_true', help='Report values as a percentage of matching results')
 parser.add_argument('-L', '--last', action='store_true', help='For each item+method, use the last entry supplied (default: first)')
+parser.add_argument('-S', '--summary', type=str, help='Also write the count in each bucket for each method to this file, to merge with others later with -f summary (-s, -n and -L apply when it is written)')
 parser.add_argument('-g', '--graph', type=str, help='Render SVG graph to this file')
+parser.add_argument('--graph-points', type=int, help='Most points to draw for each method in the graph, leaving out those the line passes straight through first (default: 2000, 0 for all)', default=2000)
+parser.add_argument('--checkpoint', type=str, help='Save the buckets so far and what has been read of each input to this file, and on later runs read only the lines added since (CSV input only)', default=None)
+parser.add_argument('-e', '--engine', type=str, help='Bucketing implementation (default: numpy if installed)', choices=['python', 'numpy'], default=(numpy and 'numpy') or 'python')
+parser.add_argument('--profile', action='store_true', help='Time each stage and count the memory it allocates, and write a breakdown to stderr at the end')
+parser.add_argument('--profile-output', type=str, help='Also save cProfile statistics for pstats to this file (implies --profile)', default=None)
 parser.add_argument('--debug', type=str, help='Set log level (default:WARN)', default=None)
 
 args = parser.parse_args()
@@ -28,103 +45,362 @@ if args.debug:
 else:
     logging.root.setLevel(logging.WARN)
 
-data = csv.reader( open( args.csv, 'r').readlines() )
-
-BUCKETS = {}
+if args.profile or args.profile_output:
+    profiling.enable(args.profile_output)
+    timeparse.parse_interval = profiling.timed('parse intervals', timeparse.parse_interval)
+
+if args.engine == 'numpy' and not numpy:
+    parser.error('numpy is not installed')
+
+# with --checkpoint, where the last run stopped reading each file
+CHECKPOINT = None
+SPANS = {}
+if args.checkpoint:
+    if args.format != 'csv':
+        parser.error('--checkpoint needs CSV input')
+    try:
+        CHECKPOINT = checkpoint.Checkpoint(args.checkpoint, { 'csv': [os.path.abspath(filename) for filename in args.csv],
+                                                              'bucket_size': args.bucket_size,
+                                                              'not_found': args.not_found,
+                                                              'last': args.last })
+        for filename in args.csv:
+            SPANS[filename] = CHECKPOINT.span(filename)
+    except ValueError as e:
+        parser.error(str(e))
+
+def open_csv(filename):
+    if CHECKPOINT:
+        return checkpoint.read_lines(filename, *SPANS[filename])
+    return open(filename, 'r')
+
+def read_lines(filenames):
+    for filename in filenames:
+        if args.format == 'binary':
+            # (the python engine's; the numpy engine reads read_columns)
+            # intervals arrive as float seconds rather than strings
+            for uuid,src,origin,interval,status,title in columnar.read_rows(filename, columnar.ANALYSE_SCHEMA):
+                yield [uuid,src,origin,interval] + status.split(',') + [title]
+        else:
+            for line in csv.reader( open_csv(filename) ):
+                yield line
+
+def read_summaries(filenames):
+    # merges the bucket counts from each summary, which must all have the
+    # same bucket size
+    BUCKETS = {}
+    bucket_size = None
+    for filename in filenames:
+        with open(filename, 'r') as f:
+            summary = json.load(f)
+        if bucket_size is not None and summary['bucket_size'] != bucket_size:
+            parser.error('%s has buckets of %ss, not %ss like the others' % (filename, summary['bucket_size'], bucket_size))
+        bucket_size = summary['bucket_size']
+        for method, buckets in summary['methods'].items():
+            method = sys.intern(method)
+            if method not in BUCKETS:
+                BUCKETS[method] = {}
+            for b, count in buckets.items():
+                b = int(b)
+                BUCKETS[method][b] = BUCKETS[method].get(b, 0) + count
+    return bucket_size, BUCKETS
+
+def write_summary(filename, BUCKETS):
+    summary = { 'bucket_size': args.bucket_size,
+                'methods': dict((method, dict((str(b), count) for b, count in buckets.items() if b >= 0))
+                                for method, buckets in BUCKETS.items()) }
+    with open(filename, 'w') as f:
+        json.dump(summary, f, sort_keys=True)
+
+def read_columns(filenames):
+    # binary input for the numpy engine, a column at a time, as (methods,
+    # index into methods of each line to bucket, its interval in seconds).
+    # Lines are numbered by uuid and method from each chunk's dictionaries,
+    # and as with read_lines, the first (or with -L, last) for each item+method
+    # is the one that counts, whether or not it is bucketed
+    uuid_numbers = {}
+    method_numbers = {}
+    # whether the lines with each method are bucketed
+    bucketed = []
+    uuids = []
+    method_codes = []
+    intervals = []
+    for filename in filenames:
+        for uuid, src, origin, interval, status in columnar.read_columns(filename, ['uuid', 'source', 'origin', 'interval', 'status']):
+            numbers = [uuid_numbers.setdefault(value, len(uuid_numbers)) for value in uuid[1]]
+            uuids.append(numpy.array(numbers, dtype=numpy.int64)[uuid[0]])
+
+            # each combination of source, origin and status in the chunk
+            combined = (src[0].astype(numpy.int64)*len(origin[1]) + origin[0])*len(status[1]) + status[0]
+            combinations, inverse = numpy.unique(combined, return_inverse=True)
+            numbers = []
+            for combination in combinations.tolist():
+                combination, status_code = divmod(combination, len(status[1]))
+                src_code, origin_code = divmod(combination, len(origin[1]))
+                method = '%s:%s:%s' % (src[1][src_code], origin[1][origin_code], status[1][status_code].replace(',', ':'))
+                if method not in method_numbers:
+                    method_numbers[method] = len(method_numbers)
+                    bucketed.append(origin[1][origin_code] != 'UNKNOWN' and
+                                    (args.not_found or not status[1][status_code].startswith('4')))
+                numbers.append(method_numbers[method])
+            method_codes.append(numpy.array(numbers, dtype=numpy.int64)[inverse.reshape(-1)])
+            intervals.append(numpy.asarray(interval, dtype=numpy.float64))
+
+    if not uuids:
+        return [], numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.float64)
+    uuids = numpy.concatenate(uuids)
+    method_codes = numpy.concatenate(method_codes)
+    intervals = numpy.concatenate(intervals)
+
+    keys = uuids*len(method_numbers) + method_codes
+    if args.last:
+        _, last = numpy.unique(keys[::-1], return_index=True)
+        kept = len(keys) - 1 - last
+    else:
+        _, kept = numpy.unique(keys, return_index=True)
+    kept = kept[numpy.array(bucketed, dtype=bool)[method_codes[kept]]]
 
-max_bucket = 0
+    # only the methods with lines to bucket
+    names = sorted(method_numbers, key=method_numbers.get)
+    used, codes = numpy.unique(method_codes[kept], return_inverse=True)
+    return [names[i] for i in used.tolist()], codes.reshape(-1), intervals[kept]
 
+# only the fields needed for bucketing are kept for each item+method, so
+# memory depends on the number of distinct keys, not the number of lines
 lines_to_include = {}
+# or with binary input to the numpy engine, the columns read_columns returns
+COLUMNS = None
+
+if args.format == 'binary' and args.engine == 'numpy':
+    with profiling.stage('keys'):
+        COLUMNS = read_columns(args.csv)
+elif args.format != 'summary':
+    profiling.start('keys')
+    for line in profiling.timed_iter('read', read_lines(args.csv)):
+        key = ':'.join(line[:3])+':'.join(line[4:-1])
+
+        if args.last or key not in lines_to_include:
+            if len(line)<5 or line[2]=='UNKNOWN':
+                lines_to_include[key] = None
+            else:
+                method = sys.intern('%s:%s:%s' % (line[1], line[2], ':'.join(line[4:-1])))
+                lines_to_include[key] = (method, line[3], sys.intern(line[4]))
+    profiling.stop()
 
-for line in data:
-    key = ':'.join(line[:3])+':'.join(line[4:-1])
-
-    if args.last:
-        lines_to_include[key] = line
-    elif key not in lines_to_include:
-        lines_to_include[key] = line
-
-for line in lines_to_include.values():
-    if len(line)<5:
-        continue
-
-    if line[2]=='UNKNOWN':
-        continue
+def parse_intervals(included):
+    # yields (method, seconds) for each line that should be bucketed
+    for line in included:
+        if line is None:
+            continue
 
-    method = '%s:%s:%s' % (line[1], line[2], ':'.join(line[4:-1]))
+        method, interval, status = line
 
-    interval = re.match('(-?)([0-9]+):([0-9]+):([0-9.]+)',line[3])
+        if isinstance(interval, float):
+            seconds = interval
+        else:
+            seconds = timeparse.parse_interval(interval)
+            if seconds is None:
+                logging.warn("Couldn't get interval from line %s" % (line,))
+                continue
 
-    status = line[4]
+        if status.startswith('4') and not args.not_found:
+            logging.debug("Discarding 4xx line %s" % (line,))
+        else:
+            yield method, seconds
 
-    if not interval:
-        logging.warn("Couldn't get interval from line %s" % line)
-    elif status.startswith('4') and not args.not_found:
-        logging.debug("Discarding 4xx line %s" % line)
-    else:
-        seconds = float(interval.group(4)) + int(interval.group(3))*60 + int(interval.group(2))*60*60
-        if interval.group(1) == '-':
-            seconds = -seconds
+def proportions(counts, max_counts):
+    prop_counts = []
+    for i,count in enumerate(counts):
+        if max_counts[i] > 0:
+            if args.percentage:
+                prop_counts.append( str(count*100 / max_counts[i]) )
+            else:
+                prop_counts.append( str(count) )
+    return prop_counts
+
+def fold_buckets(included, INCLUDED, BUCKETS):
+    # adds the lines read this time to the buckets from earlier runs, where
+    # INCLUDED has the (method, bucket) each item+method was counted in, or
+    # None if it wasn't; with -L, a line replaces the one counted before
+    for key, line in included.items():
+        if key in INCLUDED:
+            if not args.last:
+                continue
+            if INCLUDED[key] is not None:
+                method, b = INCLUDED[key]
+                BUCKETS[method][b] -= 1
+                if not BUCKETS[method][b]:
+                    del BUCKETS[method][b]
+                    if not BUCKETS[method]:
+                        del BUCKETS[method]
+        INCLUDED[key] = None
+        for method, seconds in parse_intervals([line]):
+            b = math.ceil( seconds / args.bucket_size )
+            INCLUDED[key] = (method, b)
+            if method not in BUCKETS:
+                BUCKETS[method] = {}
+            BUCKETS[method][b] = BUCKETS[method].get(b, 0) + 1
+
+def count_buckets(included):
+    BUCKETS = {}
+
+    for method, seconds in parse_intervals(included):
         seconds = math.ceil( seconds / args.bucket_size )
         if method not in BUCKETS:
             BUCKETS[method] = {}
         if seconds not in BUCKETS[method]:
             BUCKETS[method][seconds] = 0
         BUCKETS[method][seconds] += 1
-        if seconds > max_bucket:
-            max_bucket = seconds
 
-methods = sorted( BUCKETS.keys() )
+    return BUCKETS
 
-counts = [0] * len(methods)
+def column_buckets(names, codes, seconds):
+    # count_buckets for what read_columns returns
+    BUCKETS = {}
+    buckets = numpy.ceil( seconds / args.bucket_size ).astype(numpy.int64)
+    pairs, counts = numpy.unique(numpy.stack([codes, buckets]), axis=1, return_counts=True)
+    for (code, b), count in zip(pairs.T.tolist(), counts.tolist()):
+        if names[code] not in BUCKETS:
+            BUCKETS[names[code]] = {}
+        BUCKETS[names[code]][b] = count
+    return BUCKETS
 
-# count up everything to get true percentages
-for b in range(0,max_bucket+1):
-    for i,method in enumerate(methods):
-        if b in BUCKETS[method]:
-            counts[i] += BUCKETS[method][b]
+def python_buckets(BUCKETS):
+    max_bucket = max([b for buckets in BUCKETS.values() for b in buckets] + [0])
+
+    methods = sorted( BUCKETS.keys() )
 
+    counts = [0] * len(methods)
+
+    # count up everything to get true percentages
+    for b in range(0,max_bucket+1):
+        for i,method in enumerate(methods):
+            if b in BUCKETS[method]:
+                counts[i] += BUCKETS[method][b]
+
+    max_counts = counts
+
+    limit = args.limit or max_bucket + 1
+
+    def rows():
+        counts = [0] * len(methods)
+        for b in range(0,limit):
+            for i,method in enumerate(methods):
+                if b in BUCKETS[method]:
+                    if args.cumulative:
+                        counts[i] += BUCKETS[method][b]
+                    else:
+                        counts[i] = BUCKETS[method][b]
+                else:
+                    if not args.cumulative:
+                        counts[i] = 0
+
+            yield proportions(counts, max_counts)
+
+    return methods, max_counts, rows()
+
+def numpy_buckets(included):
+    method_codes = {}
+    codes = []
+    seconds = []
+    for method, interval in parse_intervals(included):
+        codes.append( method_codes.setdefault(method, len(method_codes)) )
+        seconds.append( interval )
+
+    return numpy_histogram(sorted( method_codes.keys(), key=method_codes.get ),
+                           numpy.array(codes, dtype=numpy.int64), numpy.array(seconds, dtype=numpy.float64))
+
+def numpy_histogram(names, codes, seconds):
+    # where the method of each line is names[code], with its interval in seconds
+
+    # number the methods in sorted order
+    method_codes = dict((method, code) for code, method in enumerate(names))
+    methods = sorted( names )
+    order = numpy.empty(len(methods), dtype=numpy.int64)
+    for i,method in enumerate(methods):
+        order[method_codes[method]] = i
+    codes = order[codes]
+
+    buckets = numpy.ceil( seconds / args.bucket_size ).astype(numpy.int64)
+
+    # negative buckets are never reported
+    keep = buckets >= 0
+    codes = codes[keep]
+    buckets = buckets[keep]
+
+    max_counts = numpy.bincount(codes, minlength=len(methods))
+    max_bucket = int(buckets.max()) if len(buckets) else 0
+    limit = args.limit or max_bucket + 1
+
+    keep = buckets < limit
+    histogram = numpy.bincount(codes[keep]*limit + buckets[keep], minlength=len(methods)*limit)
+    histogram = histogram.reshape(len(methods), limit)
+
+    if args.cumulative:
+        histogram = numpy.cumsum(histogram, axis=1)
+
+    reported = max_counts > 0
+    histogram = histogram[reported].T
+    if args.percentage:
+        histogram = histogram*100 / max_counts[reported]
+
+    def rows():
+        for counts in histogram.tolist():
+            yield [str(count) for count in counts]
+
+    return methods, max_counts.tolist(), rows()
+
+
+# (the python engine's rows are only worked out as they are written, so
+# that is part of output)
+profiling.start('buckets')
+if args.format == 'summary':
+    # merging needs nothing more than adding up the counts in each bucket
+    args.bucket_size, BUCKETS = read_summaries(args.csv)
+    methods, max_counts, rows = python_buckets(BUCKETS)
+elif CHECKPOINT:
+    INCLUDED, BUCKETS = CHECKPOINT.state or ({}, {})
+    fold_buckets(lines_to_include, INCLUDED, BUCKETS)
+    methods, max_counts, rows = python_buckets(BUCKETS)
+elif COLUMNS:
+    methods, max_counts, rows = numpy_histogram(*COLUMNS)
+elif args.engine == 'numpy':
+    methods, max_counts, rows = numpy_buckets(lines_to_include.values())
+else:
+    methods, max_counts, rows = python_buckets(count_buckets(lines_to_include.values()))
+profiling.stop()
+
+if args.summary:
+    with profiling.stage('summary'):
+        if COLUMNS:
+            BUCKETS = column_buckets(*COLUMNS)
+        elif args.format != 'summary' and not CHECKPOINT:
+            BUCKETS = count_buckets(lines_to_include.values())
+        write_summary(args.summary, BUCKETS)
+
+profiling.start('output')
 s = 'time'
 
 for i,method in enumerate(methods):
-    if counts[i]>0:
+    if max_counts[i]>0:
         s += ',%s' % method
 
 print(s)
 
-max_counts = counts
-
-logging.info( 'Methods and counts: %s', [(methods[x], counts[x]) for x,_ in enumerate(methods)] )
-
-counts = [0] * len(methods)
-
-if not args.limit:
-    args.limit = max_bucket + 1
+logging.info( 'Methods and counts: %s', [(methods[x], max_counts[x]) for x,_ in enumerate(methods)] )
 
 RESULTS = []
-for b in range(0,args.limit):
-    for i,method in enumerate(methods):
-        if b in BUCKETS[method]:
-            if args.cumulative:
-                counts[i] += BUCKETS[method][b]
-            else:
-                counts[i] = BUCKETS[method][b]
-        else:
-            if not args.cumulative:
-                counts[i] = 0
-
-    prop_counts = []
-    for i,count in enumerate(counts):
-        if max_counts[i] > 0:
-            if args.percentage:
-                prop_counts.append( str(count*100 / max_counts[i]) )
-            else:
-                prop_counts.append( str(count) )
-
+for b,prop_counts in enumerate(rows):
     RESULTS.append( (b*args.bucket_size,) + tuple(prop_counts) )
     print('%s,%s' % (b*args.bucket_size, ','.join(prop_counts)))
+profiling.stop()
+
+if CHECKPOINT:
+    # only once the output is written
+    sys.stdout.flush()
+    CHECKPOINT.save( (INCLUDED, BUCKETS) )
 
 if args.graph:
+    profiling.start('graph')
     xy = pygal.XY(width=800,
                   height=450,
                   show_dots=False,
@@ -135,6 +411,7 @@ if args.graph:
         line = []
         for point in RESULTS:
             line.append( (float(point[0]), float(point[i+1])) )
-        xy.add(method, line)
+        xy.add(method, downsample.line(line, args.graph_points))
     xy.render_to_file(args.graph)
+    profiling.stop()
 
@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+#coding: utf-8
+
+import logging
+import argparse
+import asyncio
+import math
+import sys
+import time
+import ftapi
+import probes
+
+# Runs probes through ftapi.AsyncFTClient against a local stub server which
+# takes --delay ms to answer each request, and checks that they run
+# concurrently up to the client's limits and no further, that connections
+# are kept alive and reused, and that the event loop is never blocked while
+# they wait. Exits non-zero if any check fails.
+
+parser = argparse.ArgumentParser(description="Check the concurrency of AsyncFTClient against a local stub server")
+
+parser.add_argument('-n', '--requests', type=int, help='Number of probes to run (default: 120)', default=120)
+parser.add_argument('-d', '--delay', type=float, help='Milliseconds the stub server takes to answer each request (default: 200)', default=200)
+parser.add_argument('-H', '--hosts', type=int, help='Number of hosts to spread the probes over (default: 3)', default=3)
+parser.add_argument('-l', '--limit', type=int, help='Most requests the client may have in flight (default: 20)', default=20)
+parser.add_argument('--limit-per-host', type=int, help='Most requests the client may have in flight to one host (default: 8)', default=8)
+parser.add_argument('--debug', type=str, help='Set log level (default:WARN)', default=None)
+
+args = parser.parse_args()
+
+if args.debug:
+    logging.root.setLevel(getattr(logging,args.debug))
+else:
+    logging.root.setLevel(logging.WARN)
+
+
+class StubServer:
+    # answers GET /<host>/<path> with the path, after the delay, on
+    # keep-alive connections, counting what the client does
+    def __init__(self, delay):
+        self.delay = delay
+        self.connections = 0
+        self.requests = 0
+        self.in_flight = {}
+        self.max_in_flight = {}
+        self.max_total = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                path = request_line.decode('latin-1').split()[1]
+                host = path.split('/')[1]
+
+                self.requests += 1
+                self.in_flight[host] = self.in_flight.get(host, 0) + 1
+                self.max_in_flight[host] = max(self.max_in_flight.get(host, 0), self.in_flight[host])
+                self.max_total = max(self.max_total, sum(self.in_flight.values()))
+                await asyncio.sleep(self.delay)
+                self.in_flight[host] -= 1
+
+                body = path.encode('utf-8')
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n' % len(body) + body)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def check():
+    loop = asyncio.get_event_loop()
+    stub = StubServer(args.delay / 1000.0)
+    server = await asyncio.start_server(stub.handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    client = ftapi.AsyncFTClient(limit=args.limit, limit_per_host=args.limit_per_host,
+                                 host_override='http://127.0.0.1:%d' % port)
+    # as collect.py runs them, with as many workers as the client's limit
+    scheduler = probes.ProbeScheduler(workers=args.limit)
+    lag = probes.LagMonitor(interval=0.01)
+    responses = {}
+    done = asyncio.Event()
+
+    def make_probe(url):
+        async def probe():
+            responses[url] = await client.get_url_force(url)
+            if len(responses) == args.requests:
+                done.set()
+            return None
+        return probe
+
+    scheduler.start()
+    lag_task = loop.create_task(lag.run())
+    started = time.monotonic()
+    for i in range(args.requests):
+        url = 'http://host%d.example/content/%d' % (i % args.hosts, i)
+        scheduler.schedule(url, 0, make_probe(url))
+    await done.wait()
+    wall = time.monotonic() - started
+
+    lag_task.cancel()
+    await scheduler.stop()
+    client.close()
+    server.close()
+    await server.wait_closed()
+    return stub, responses, lag, wall
+
+
+stub, responses, lag, wall = asyncio.get_event_loop().run_until_complete(check())
+
+concurrency = min(args.limit, args.hosts * args.limit_per_host)
+expected = math.ceil(args.requests / concurrency) * args.delay / 1000.0
+serial = args.requests * args.delay / 1000.0
+lag_stats = lag.stats()
+
+checks = [('every probe got its own response',
+           all(response == '/%s/%s' % tuple(url.split('/', 3)[2:]) for url, response in responses.items()),
+           '%d responses' % len(responses)),
+          ('no host had more than %d requests in flight' % args.limit_per_host,
+           max(stub.max_in_flight.values()) <= args.limit_per_host,
+           'most per host %s' % sorted(stub.max_in_flight.values())),
+          ('no more than %d requests were in flight' % args.limit,
+           stub.max_total <= args.limit,
+           'most in flight %d' % stub.max_total),
+          ('requests ran %d at a time' % concurrency,
+           stub.max_total == concurrency,
+           'most in flight %d' % stub.max_total),
+          ('probes took about as long as %d rounds of requests' % math.ceil(args.requests / concurrency),
+           wall < expected * 1.5 + 0.1,
+           '%.2fs, against %.2fs expected and %.2fs one at a time' % (wall, expected, serial)),
+          ('connections were reused',
+           stub.connections <= args.hosts * args.limit_per_host,
+           '%d connections for %d requests' % (stub.connections, stub.requests)),
+          ('the event loop was never blocked while requests waited',
+           lag_stats['lag_ms_max'] < args.delay / 4,
+           'loop lag p50 %.1fms, p99 %.1fms, max %.1fms' %
+           (lag_stats['lag_ms_p50'], lag_stats['lag_ms_p99'], lag_stats['lag_ms_max']))]
+
+failed = 0
+for name, passed, detail in checks:
+    print('%s: %s (%s)' % ((passed and 'ok') or 'FAILED', name, detail))
+    if not passed:
+        failed += 1
+
+if failed:
+    sys.exit('%d of %d checks failed' % (failed, len(checks)))
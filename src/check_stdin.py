@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+#coding: utf-8
+
+import logging
+import argparse
+import csv
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import timeparse
+
+# Feeds lines with new uuids to collect.py -I through a pipe, one at a
+# time, and checks how long after each line was written collect.py says
+# it saw the uuid in it: the latency reading stdin adds to everything
+# collect.py measures. Exits non-zero if the given quantile is over the
+# limit.
+
+SRC = os.path.dirname(os.path.abspath(__file__))
+
+parser = argparse.ArgumentParser(description="Check the latency collect.py -I adds to lines arriving through a pipe")
+
+parser.add_argument('-n', '--lines', type=int, help='Number of lines to send (default: 200)', default=200)
+parser.add_argument('-i', '--interval', type=float, help='Milliseconds between lines (default: 20)', default=20)
+parser.add_argument('-l', '--limit', type=float, help='Most milliseconds of added latency allowed (default: 1)', default=1)
+parser.add_argument('-q', '--quantile', type=float, help='Quantile of the latencies held to the limit (default: 0.9)', default=0.9)
+parser.add_argument('--startup', type=float, help='Seconds to give collect.py to start before sending lines (default: 2)', default=2)
+parser.add_argument('--debug', type=str, help='Set log level (default:WARN)', default=None)
+
+args = parser.parse_args()
+
+if args.debug:
+    logging.root.setLevel(getattr(logging,args.debug))
+else:
+    logging.root.setLevel(logging.WARN)
+
+work = tempfile.mkdtemp(prefix='check-stdin-')
+output = os.path.join(work, 'out.csv')
+
+collect = subprocess.Popen([sys.executable, os.path.join(SRC, 'collect.py'), '-I', '-o', output],
+                           stdin=subprocess.PIPE)
+time.sleep(args.startup)
+
+sent = {}
+for i in range(args.lines):
+    line_uuid = str(uuid.uuid4())
+    line = ('%s published %s\n' % (timeparse.format_iso(timeparse.now_us()), line_uuid)).encode('utf-8')
+    sent[line_uuid] = timeparse.now_us()
+    collect.stdin.write(line)
+    collect.stdin.flush()
+    time.sleep(args.interval / 1000.0)
+collect.stdin.close()
+collect.wait(30)
+
+latencies = []
+for row in csv.reader(open(output, 'r')):
+    when, url_name, line_uuid = row[:3]
+    if url_name == 'STDIN' and line_uuid in sent:
+        latencies.append((timeparse.parse_iso(when) - sent.pop(line_uuid)) / 1000.0)
+os.remove(output)
+os.rmdir(work)
+
+if sent:
+    sys.exit('collect.py missed %d of %d lines' % (len(sent), args.lines))
+
+latencies.sort()
+measured = latencies[min(int(len(latencies) * args.quantile), len(latencies) - 1)]
+print('added latency over %d lines: p50 %.3fms, p90 %.3fms, p99 %.3fms, max %.3fms' %
+      (len(latencies), latencies[len(latencies)//2], latencies[int(len(latencies)*0.9)],
+       latencies[int(len(latencies)*0.99)], latencies[-1]))
+if measured > args.limit:
+    sys.exit('p%g added latency %.3fms is over the limit of %gms' % (args.quantile*100, measured, args.limit))
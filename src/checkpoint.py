@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+#coding: utf-8
+
+import logging
+import os
+import pickle
+
+# What a run of analyse.py or bucket.py made of input files that are still
+# being appended to, e.g. by collect.py, so that the next run only reads
+# the lines added since. A checkpoint holds how far each input file was
+# read, the options the saved state depends on, and the state itself, all
+# pickled to one file.
+#
+# Only whole lines are read, so one that is still being written is left
+# for the next run. An input file that no longer starts with what it
+# started with last time, or is shorter than what was read of it, has
+# been replaced rather than appended to, and is an error.
+
+HEAD_SIZE = 256
+
+class Checkpoint:
+    def __init__(self, filename, options):
+        self.filename = filename
+        self.options = options
+        # absolute filename -> (bytes read, first bytes of the file)
+        self.files = {}
+        self.state = None
+        try:
+            with open(filename, 'rb') as f:
+                saved = pickle.load(f)
+        except FileNotFoundError:
+            return
+        if saved['options'] != options:
+            raise ValueError('Checkpoint %s was saved with other options: %s' %
+                             (filename, ', '.join('%s=%s' % (name, value) for name, value in sorted(saved['options'].items()))))
+        self.files = saved['files']
+        self.state = saved['state']
+
+    def span(self, filename):
+        # (start, end) of the bytes of filename to read this time, from where
+        # the last run stopped to the end of the last whole line
+        path = os.path.abspath(filename)
+        start, head = self.files.get(path, (0, b''))
+        with open(filename, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < start or f.read(len(head)) != head:
+                raise ValueError('%s has changed since checkpoint %s was saved, rather than only grown' %
+                                 (filename, self.filename))
+            end = size
+            while end > start:
+                block_start = max(end - 65536, start)
+                f.seek(block_start)
+                newline = f.read(end - block_start).rfind(b'\n')
+                if newline >= 0:
+                    end = block_start + newline + 1
+                    break
+                end = block_start
+            f.seek(0)
+            head = f.read(min(end, HEAD_SIZE))
+        logging.info('Reading %s from byte %d to %d' % (filename, start, end))
+        # only saved with the state
+        self.files[path] = (end, head)
+        return start, end
+
+    def save(self, state):
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'wb') as f:
+            pickle.dump({ 'options': self.options, 'files': self.files, 'state': state }, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, self.filename)
+
+def read_lines(filename, start, end):
+    # the lines of filename between two byte offsets on line boundaries
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        for line in f:
+            if remaining <= 0:
+                return
+            remaining -= len(line)
+            yield line.decode('utf-8')
@@ -5,19 +5,24 @@ import argparse
 import logging
 import json
 import urllib.request, urllib.parse, urllib.error
-import datetime
-import time
 import sys
 import re
 import random
 import os
 import asyncio
-import select
+import atexit
 import ftapi
+import probes
+import metrics
+import notifications
+import results
+import ftcache
+import timeparse
 
 
 
 UUID_LENGTH = 36
+STDIN_LINE_LIMIT = 1024*1024
 UUID_REGEX = re.compile('[0-9A-Fa-f]{8}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{12}')
 
 URLS = {
@@ -42,12 +47,12 @@ ARTICLE_URLS = { 'WWW.FT.COM-ART': ['http://www.ft.com/cms/s/0/%s.html', ['uuid'
 
 ARTICLE_URL_KEYS = list(ARTICLE_URLS.keys())
 
-parser = argparse.ArgumentParser(description="Collect new UUIDs from various FT API URLs. Writes CSV to stdout in the form <time>,<url_name>,<uuid>,0.")
+parser = argparse.ArgumentParser(description="Collect new UUIDs from various FT API URLs. Writes CSV to stdout (or -o) in the form <time>,<url_name>,<uuid>,0,<fetch latency>.")
 
 parser.add_argument('apis', type=str, nargs='*', help='APIs to collect from: %s (default: all)' % list(URLS.keys()))
 parser.add_argument('-I', '--stdin', action='store_true', help='Collect UUIDs from standard input (overrides api list)')
 parser.add_argument('-n', '--repeat', type=int, help='How many times to poll (default: forever)', default=True)
-parser.add_argument('-p', '--poll-interval', type=int, help='Seconds to sleep between collecting', default=5)
+parser.add_argument('-p', '--poll-interval', type=int, help='Seconds between the start of each poll of all the endpoints (default: 5)', default=5)
 parser.add_argument('-s', '--since', type=int, help='Seconds before now to request notifications for', default=None)
 parser.add_argument('-a', '--articles', action='store_true', help='Investigate article URLs asynchronously.', default=False)
 parser.add_argument('-A', '--article-stats', action='store_true', help='Capture result of article URL investigation. Adds extra lines to CSV in the form <time>,<article_url_name>,<uuid>,<status>, implies -a', default=False)
@@ -55,9 +60,28 @@ parser.add_argument('-f', '--feeds', action='store_true', help='Investigate feed
 parser.add_argument('-F', '--feed-stats', action='store_true', help='Capture result of feed URL investigation. Adds extra lines to CSV in the form <time>,<feed_url_name>,<uuid>,<status>, implies -f', default=False)
 parser.add_argument('-k', '--key', type=str, help='FT API key (default: ~/.ft_api_key)', default=None)
 parser.add_argument('-c', '--cookie', type=str, help='FT cookie (default: ~/.ft_cookie)', default=None)
-parser.add_argument('-C', '--cache', type=str, help='Cache directory for article responses', default=None)
+parser.add_argument('-C', '--cache', type=str, help='Cache for article responses: a directory, or sqlite:<file> for a single-file cache, optionally followed by ?<option>=<value>&...', default=None)
 parser.add_argument('-b', '--backoff-rate', type=float, help='Exponential backoff factor (default: 1.1)', default=1.1)
+parser.add_argument('-P', '--concurrency', type=int, help='Maximum number of probes and HTTP requests in flight (default: 20)', default=20)
 parser.add_argument('-w', '--initial_wait', type=int, help='Maximum ms to wait before making first asynchronous call', default=2000)
+parser.add_argument('--overlap', type=int, help='Ask each notifications endpoint for everything since this many seconds before the latest notification seen, so that ones which turn up late are still found (default: the since interval)', default=None)
+parser.add_argument('--seen-size', type=int, help='Remember at most this many uuids per source, forgetting the least recently seen (default: 100000, 0 for no limit)', default=100000)
+parser.add_argument('--seen-ttl', type=int, help='Forget uuids not seen for this many seconds (default: 604800, a week; 0 for never)', default=7*24*60*60)
+parser.add_argument('--adaptive', action='store_true', help='Start probing each endpoint around when it has first returned previous uuids, rather than straight away', default=False)
+parser.add_argument('--adaptive-quantile', type=float, help='With --adaptive, start probing at this quantile of previous arrival times (default: 0.01)', default=0.01)
+parser.add_argument('--latency-model', type=str, help='With --adaptive, load arrival times learnt by previous runs (or simulate.py) from this file, and save them on exit', default=None)
+parser.add_argument('--stats-interval', type=int, help='Seconds between logging probe scheduler and event loop statistics at INFO (default: 60, 0 to disable)', default=60)
+parser.add_argument('--stats-file', type=str, help='Also write the statistics to this file as JSON, at every stats interval and on exit', default=None)
+parser.add_argument('--metrics-listen', type=str, help='Serve metrics for scraping at [<host>:]<port> (host defaults to 127.0.0.1), or on a Unix socket at a path or unix:<path>, in the Prometheus text format or as JSON at /metrics.json', default=None)
+parser.add_argument('--metrics-file', type=str, help='Write a snapshot of the metrics to this file as JSON every --metrics-interval seconds and on exit', default=None)
+parser.add_argument('--metrics-interval', type=int, help='Seconds between metrics snapshots (default: 60)', default=60)
+parser.add_argument('--host-override', type=str, help='Send every request to this server instead, e.g. http://127.0.0.1:8080 for mockapi.py, with the host it was for as the first part of the path', default=None)
+parser.add_argument('-o', '--output', type=str, help='Write results to this file rather than stdout', default=None)
+parser.add_argument('--flush-interval', type=float, help='Write results at most this many seconds after they are collected (default: 1)', default=1.0)
+parser.add_argument('--flush-rows', type=int, help='Write results as soon as this many are waiting (default: 1000)', default=1000)
+parser.add_argument('--rotate-size', type=str, help='With -o, start a new file once it reaches this size, e.g. 100M (default: never)', default='0')
+parser.add_argument('--rotate-interval', type=int, help='With -o, start a new file after this many seconds (default: never)', default=0)
+parser.add_argument('--output-format', type=str, help='Write results as CSV or in the binary columnar format (default: csv)', choices=['csv', 'binary'], default='csv')
 parser.add_argument('--debug', type=str, help='Set log level (default:WARN)', default=None)
 
 args = parser.parse_args()
@@ -79,6 +103,9 @@ if not args.since:
     args.since = (args.poll_interval // 60)*60 + 120
 logging.info("Using since interval of %s s" % args.since)
 
+if args.overlap is None:
+    args.overlap = args.since
+
 if not args.key:
     try:
         args.key = open(os.path.expanduser('~/.ft_api_key'),'r').read().strip()
@@ -93,6 +120,36 @@ if not args.cookie:
 
 
 
+def emit(when, url_name, uuid, status, latency=None):
+    # when is in microseconds since the epoch, and latency (how long the
+    # request it came from took, for polls) in microseconds
+    WRITER.write( (when, url_name, uuid, status, latency) )
+
+def flush():
+    WRITER.flush()
+
+
+class ThreadedLineReader:
+    # readline() for files the event loop can't watch, such as regular files
+    def __init__(self, f):
+        self.f = f
+
+    async def readline(self):
+        line = await asyncio.get_event_loop().run_in_executor(None, self.f.readline)
+        return line
+
+async def open_stdin():
+    # lines from a pipe wake the event loop as soon as they arrive
+    loop = asyncio.get_event_loop()
+    reader = asyncio.StreamReader(limit=STDIN_LINE_LIMIT)
+    try:
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin.buffer)
+    except ValueError:
+        logging.info('stdin is not a pipe, reading it on a thread')
+        return ThreadedLineReader(sys.stdin.buffer)
+    return reader
+
+
 def populate_fields(url, fields, **replace):
     if fields is None:
         return url
@@ -106,7 +163,6 @@ def populate_fields(url, fields, **replace):
         return url % tuple(field_values)
 
 
-@asyncio.coroutine
 def collect_article(uuid, article_apis=None, article_stats=False, article_cache=None, key='', cookie='',
                         backoff_rate=1.5, wait_time=0, backoff=250, give_up_time=20000):
 
@@ -123,45 +179,37 @@ def collect_article(uuid, article_apis=None, article_stats=False, article_cache=
     key = (with_key and key) or ''
     cookie = (with_cookie and cookie) or ''
 
-    # if not told how long to wait, wait a random time
-    if wait_time:
-        logging.info('%s (%s): told to wait %sms' % (uuid,url_name,wait_time))
-    else:
-        wait_time = random.random()*backoff
-        backoff *= backoff_rate
-        logging.info('%s (%s): backing off for %sms (out of %s)' % (uuid,url_name,wait_time,backoff))
+    seen = timeparse.now_us()
+    state, wait_time = first_probe(uuid, url_name, backoff_rate, wait_time, backoff, give_up_time)
+    attempts = 0
 
-    yield from asyncio.sleep(wait_time/1000.0)
+    async def probe():
+        nonlocal attempts
+        attempts += 1
+        result_code = 200
 
-    result_code = 200
+        started = loop.time()
+        try:
+            response = await CLIENT.get_url(url, key, cookie, with_next)
+        except urllib.error.HTTPError as e:
+            response = None
+            result_code = e.code
+        metrics.observe('probe_request_seconds', loop.time() - started, endpoint=url_name)
 
-    try:
-        response = ftapi.CachingFTURLopener(cache=article_cache,cache_errors=False).get_url(url, key, cookie, with_next)
-    except urllib.error.HTTPError as e:
-        response = None
-        result_code = e.code
+        if article_stats:
+            logging.debug('Article %s:%s status %s', url_name, uuid, result_code)
+            emit( timeparse.now_us(), url_name, uuid, result_code )
 
-    if article_stats:
-        logging.debug('Article %s:%s status %s' % (url_name, uuid, result_code))
-        print( '%s,%s,%s,%s' % ( datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ"), url_name, uuid, result_code) )
+        return next_probe(uuid, url_name, result_code, state, seen, attempts)
 
-    if result_code == 200:
-        logging.info('%s (%s): found, stopping' % (uuid, url_name))
-    elif backoff > give_up_time:
-        logging.info('%s (%s): giving up' % (uuid, url_name))
-    else:
-        # retry (after another random time)
-        logging.debug('%s (%s): retrying now' % (uuid,url_name))
-        asyncio.async(collect_article(uuid, [url_name], article_stats, article_cache, key, cookie, backoff_rate=backoff_rate,
-            backoff=backoff))
+    SCHEDULER.schedule((uuid, url_name), wait_time/1000.0, probe)
 
 
-@asyncio.coroutine
 def collect_feed(uuid, then,
                  feed_apis=None, feed_stats=False, feed_cache=None, key='', cookie='',
                  backoff_rate=1.5, wait_time=0, backoff=1000, give_up_time=100000):
 
-    logging.info('collect_feed %s' % feed_apis)
+    logging.info('collect_feed %s', feed_apis)
 
     if not feed_apis:
         logging.debug('No APIs for %s',uuid)
@@ -178,144 +226,292 @@ def collect_feed(uuid, then,
     key = (with_key and key) or ''
     cookie = (with_cookie and cookie) or ''
 
-    # if not told how long to wait, wait a random time
-    if wait_time:
-        logging.info('%s (%s): told to wait %sms' % (uuid,url_name,wait_time))
-    else:
-        wait_time = random.random()*backoff
-        backoff *= backoff_rate
-        logging.info('%s (%s): backing off for %sms (out of %s)' % (uuid,url_name,wait_time,backoff))
+    seen = timeparse.now_us()
+    state, wait_time = first_probe(uuid, url_name, backoff_rate, wait_time, backoff, give_up_time)
+    attempts = 0
+
+    async def probe():
+        nonlocal attempts
+        attempts += 1
+        result_code = 200
+
+        started = loop.time()
+        try:
+            response = await CLIENT.get_url(url, key, cookie, with_next)
+        except urllib.error.HTTPError as e:
+            response = None
+            result_code = e.code
+        metrics.observe('probe_request_seconds', loop.time() - started, endpoint=url_name)
+
+        if result_code == 200:
+            if response is None:
+                logging.warn('Got None for URL %s',url)
+                result_code = 404
+            else:
+                if uuid not in response:
+                    result_code = 444 # article was not in the feed
 
-    yield from asyncio.sleep(wait_time/1000.0)
+        if feed_stats:
+            logging.debug('Feed %s:%s status %s', url_name, uuid, result_code)
+            emit( timeparse.now_us(), url_name, uuid, result_code )
 
-    result_code = 200
+        return next_probe(uuid, url_name, result_code, state, seen, attempts)
 
-    try:
-        response = ftapi.CachingFTURLopener(cache=feed_cache,cache_errors=False).get_url(url, key, cookie, with_next)
-    except urllib.error.HTTPError as e:
-        response = None
-        result_code = e.code
+    SCHEDULER.schedule((uuid, url_name), wait_time/1000.0, probe)
 
-    if result_code == 200:
-        if response is None:
-            logging.warn('Got None for URL %s',url)
-            result_code = 404
-        else:
-            if uuid not in response:
-                result_code = 444 # article was not in the feed
 
-    if feed_stats:
-        logging.debug('Feed %s:%s status %s' % (url_name, uuid, result_code))
-        print( '%s,%s,%s,%s' % ( datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ"), url_name, uuid, result_code) )
+def first_probe(uuid, url_name, backoff_rate, wait_time, backoff, give_up_time):
+    # returns the backoff state and ms until the first probe
+    metrics.inc('probes_started_total', endpoint=url_name)
+    if MODEL:
+        state = MODEL.backoff(url_name, backoff_rate, backoff, give_up_time)
+    else:
+        state = probes.Backoff(backoff_rate, backoff, give_up_time)
+
+    if state.start > wait_time:
+        wait_time = state.first_wait(wait_time)
+        logging.info('%s (%s): expected after %sms, then backing off from %s', uuid,url_name,wait_time,state.backoff)
+    elif wait_time:
+        logging.info('%s (%s): told to wait %sms', uuid,url_name,wait_time)
+    else:
+        wait_time = state.first_wait()
+        logging.info('%s (%s): backing off for %sms (out of %s)', uuid,url_name,wait_time,state.backoff)
+    return state, wait_time
+
 
+def next_probe(uuid, url_name, result_code, state, seen, attempts):
+    # seconds until the next probe, or None to stop
+    metrics.inc('probe_results_total', endpoint=url_name, status=result_code)
     if result_code == 200:
-        logging.info('%s (%s): found, stopping' % (uuid, url_name))
-    elif backoff > give_up_time:
-        logging.info('%s (%s): giving up' % (uuid, url_name))
+        logging.info('%s (%s): found, stopping', uuid, url_name)
+        elapsed_ms = (timeparse.now_us() - seen) / 1000.0
+        if MODEL:
+            MODEL.observe(url_name, elapsed_ms)
+        metrics.observe('time_to_found_seconds', elapsed_ms / 1000.0, endpoint=url_name)
+        metrics.observe('probe_attempts', attempts, endpoint=url_name, outcome='found')
+    elif state.exhausted():
+        logging.info('%s (%s): giving up', uuid, url_name)
+        metrics.observe('probe_attempts', attempts, endpoint=url_name, outcome='gave_up')
     else:
         # retry (after another random time)
-        logging.debug('%s (%s): retrying now' % (uuid,url_name))
-        asyncio.async(collect_feed(uuid, then, [url_name], feed_stats, feed_cache, key, cookie, backoff_rate=backoff_rate,
-            backoff=backoff))
+        wait_time = state.next_wait()
+        logging.info('%s (%s): backing off for %sms (out of %s)', uuid,url_name,wait_time,state.backoff)
+        return wait_time/1000.0
+
 
+def stats():
+    return { 'time': timeparse.format_iso(timeparse.now_us()),
+             'scheduler': SCHEDULER.stats(),
+             'loop': LAG.stats() }
 
-@asyncio.coroutine
-def collect_stdin(article_apis=None, article_stats=False, since=None,
+def write_stats(filename):
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as f:
+        json.dump(stats(), f, sort_keys=True)
+    os.replace(tmp_filename, filename)
+
+async def report_stats(interval):
+    while True:
+        await asyncio.sleep(interval)
+        logging.info('Probe scheduler: %s, event loop: %s' % (SCHEDULER.stats(), LAG.stats()))
+        if args.stats_file:
+            write_stats(args.stats_file)
+
+
+async def collect_stdin(article_apis=None, article_stats=False, since=None,
                   feed_apis=None, feed_stats=False, cache=None,
                  key='',cookie=''):
-    seen_ids = set()
+    seen_ids = notifications.SeenSet(args.seen_size, args.seen_ttl)
+    stdin = await open_stdin()
     while True:
-        # FIXME: find a way to use asyncio to get stdin asynchronously
-        while sys.stdin in select.select([sys.stdin], [], [], 0)[0]:
-            line = sys.stdin.readline()
-            if line:
-                logging.info('Got line: %s' % line)
-                new_ids = [uuid for uuid in UUID_REGEX.findall(line) if uuid not in seen_ids]
-                if new_ids:
-                    logging.info('UUIDs found: %s' % new_ids)
-                now = datetime.datetime.utcnow()
-                for new_id in new_ids:
-                    print( '%s,%s,%s,0' % ( now.strftime("%Y-%m-%dT%H:%M:%S.%fZ"), 'STDIN', new_id ) )
-                    for article_api in article_apis:
-                        asyncio.async(collect_article(new_id, 
-                                     [article_api], article_stats, cache,
-                                     key=key, cookie=cookie, backoff_rate=args.backoff_rate,
-                                     wait_time=random.random()*args.initial_wait))
-
-                    now = datetime.datetime.utcnow()
-                    then = now - datetime.timedelta(0,since,0)
-                    for feed_api in feed_apis:
-                        asyncio.async(collect_feed(new_id, then,
-                                     [feed_api], feed_stats, cache,
-                                     key=key, cookie=cookie, backoff_rate=args.backoff_rate,
-                                     wait_time=random.random()*args.initial_wait))
-                    seen_ids.add(new_id)
-            else:
-                raise SystemExit('No more input.')
+        line = await stdin.readline()
+        # the time the line arrived is the time it was seen
+        now = timeparse.now_us()
+        if line:
+            line = line.decode('utf-8', 'replace')
+            logging.info('Got line: %s', line)
+            new_ids = [uuid for uuid in UUID_REGEX.findall(line) if seen_ids.add(uuid, now)]
+            metrics.inc('stdin_lines_total')
+            metrics.inc('new_uuids_total', len(new_ids), source='STDIN')
+            if new_ids:
+                logging.info('UUIDs found: %s', new_ids)
+            then = timeparse.to_datetime(now - since*timeparse.SECOND)
+            for new_id in new_ids:
+                emit( now, 'STDIN', new_id, 0 )
+                for article_api in article_apis:
+                    collect_article(new_id, 
+                                 [article_api], article_stats, cache,
+                                 key=key, cookie=cookie, backoff_rate=args.backoff_rate,
+                                 wait_time=random.random()*args.initial_wait)
+
+                for feed_api in feed_apis:
+                    collect_feed(new_id, then,
+                                 [feed_api], feed_stats, cache,
+                                 key=key, cookie=cookie, backoff_rate=args.backoff_rate,
+                                 wait_time=random.random()*args.initial_wait)
         else:
-            yield from asyncio.sleep(0.05)
+            raise SystemExit('No more input.')
 
-@asyncio.coroutine
-def collect_main(apis,since,repeat,
+async def collect_main(apis,since,repeat,
                  article_apis=None, article_stats=False,
                  feed_apis=None, feed_stats=False,
                  article_cache=None, key='',cookie=''):
 
     urls_to_hit = [(x, URLS[x]) for x in apis]
-    last_time_ids = {}
-
-    while repeat:
-        if repeat is not True:
-            repeat -=1
-
-        now = datetime.datetime.utcnow()
-        then = now - datetime.timedelta(0,since,0)
+    seen_ids = {}
+    latest = {}
+    page_sizes = {}
+
+    async def poll(url_name, url, fields, with_key, with_cookie, with_next):
+        started = timeparse.now_us()
+
+        # ask for everything since a little before the latest notification
+        # seen, so that ones which turn up late with an earlier lastModified
+        # are still found (the seen set drops those already found), or the
+        # last since seconds the first time
+        frontier = latest.get(url_name)
+        if frontier is None:
+            then = started - since*timeparse.SECOND
+        else:
+            then = min(frontier, started) - args.overlap*timeparse.SECOND
+        url = populate_fields(url, fields, since=timeparse.to_datetime(then).strftime("%Y-%m-%dT%H:%M:%SZ") )
 
-        random.shuffle(urls_to_hit)
-    
-        for url_name,(url, fields, with_key, with_cookie, with_next) in urls_to_hit:
-            url = populate_fields(url, fields, since=then.strftime("%Y-%m-%dT%H:%M:%SZ") )
+        this_key = (with_key and key) or ''
+        this_cookie = (with_cookie and cookie) or ''
 
-            this_key = (with_key and key) or ''
-            this_cookie = (with_cookie and cookie) or ''
+        # don't print out the very first requests, or we will slurp everything
+        first = url_name not in seen_ids
 
+        previous = None
+        while url:
             try:
-                response = ftapi.CachingFTURLopener().get_url(url, this_key, this_cookie, with_next)
+                response = await CLIENT.get_url_force(url, this_key, this_cookie, with_next)
             except urllib.error.HTTPError:
                 response = None
 
-            if response:
-                items = set()
-                uuids = UUID_REGEX.findall(response)
-            
-                # Assume every UUID is an item id, we'll sort out discrepancies later
-                ids_included = set(uuids)
-
-                if url_name in last_time_ids:
-                    new_ids = ids_included.difference(last_time_ids[url_name])
-                    logging.debug('%d new ids out of %d' % (len(new_ids), len(ids_included)) )
-                else:
-                    new_ids = ids_included
-
-                if url_name in last_time_ids:
-                    # don't print out the very first requests, or we will slurp everything
-                    for new_id in new_ids:
-                        print( '%s,%s,%s,0' % ( now.strftime("%Y-%m-%dT%H:%M:%S.%fZ"), url_name, new_id ) )
-                        for article_api in article_apis:
-                            asyncio.async(collect_article(new_id, 
-                                                      [article_api], article_stats, article_cache,
-                                                      key=key, cookie=cookie, backoff_rate=args.backoff_rate,
-                                                      wait_time=random.random()*args.initial_wait))
-
-                last_time_ids[url_name] = ids_included
-           
+            # the time the response arrived is the time its uuids were seen
+            now = timeparse.now_us()
+            latency = now - started
+            metrics.observe('poll_seconds', latency / timeparse.SECOND, source=url_name)
+
+            if not response:
+                metrics.inc('polls_total', source=url_name, result='error')
+                return
+
+            items, next_url = notifications.parse(response)
+            metrics.inc('polls_total', source=url_name, result='ok')
+            metrics.inc('notifications_total', len(items), source=url_name)
+            newest = max((modified for uuid, modified in items if modified), default=None)
+            if newest and newest > latest.get(url_name, 0):
+                latest[url_name] = newest
+
+            if first:
+                seen = seen_ids.setdefault(url_name, notifications.SeenSet(args.seen_size, args.seen_ttl))
+                for uuid, modified in items:
+                    seen.add(uuid, now)
+            else:
+                new_ids = [uuid for uuid, modified in items if seen_ids[url_name].add(uuid, now)]
+                logging.debug('%d new ids out of %d', len(new_ids), len(items))
+                metrics.inc('new_uuids_total', len(new_ids), source=url_name)
+                metrics.set_gauge('seen_uuids', len(seen_ids[url_name]), source=url_name)
+
+                for new_id in new_ids:
+                    emit( now, url_name, new_id, 0, latency )
+                    for article_api in article_apis:
+                        collect_article(new_id, 
+                                        [article_api], article_stats, article_cache,
+                                        key=key, cookie=cookie, backoff_rate=args.backoff_rate,
+                                        wait_time=random.random()*args.initial_wait)
+
+            # a page which was followed by one that got further was cut off
+            # at the page size; the first time, and whenever a page is that
+            # long or stops short of the latest notification seen before or
+            # of the overlap before now, carry on through its next link, for
+            # as long as each page gets further
+            if previous is not None and newest and newest > previous:
+                page_sizes[url_name] = max(page_sizes.get(url_name, 0), previous_length)
+            full = url_name in page_sizes and len(items) >= page_sizes[url_name]
+            url = None
+            if next_url and newest and (previous is None or newest > previous) and \
+               (first or full or (frontier and newest < frontier) or newest < now - args.overlap*timeparse.SECOND):
+                url = next_url
+                previous = newest
+                previous_length = len(items)
+                started = timeparse.now_us()
+
+    # poll every endpoint at once, every poll_interval seconds from the start
+    # however long the polls take, so that the schedule doesn't drift
+    next_poll = loop.time()
+    while repeat:
+        if repeat is not True:
+            repeat -=1
+
+        await asyncio.gather(*[poll(url_name, *url_spec) for url_name, url_spec in urls_to_hit])
 
         # ensure things are written for followers
-        sys.stdout.flush()
-        yield from asyncio.sleep(args.poll_interval)
+        flush()
+
+        next_poll += args.poll_interval
+        delay = next_poll - loop.time()
+        if delay < 0:
+            logging.warn('Polling took %.1fs longer than the poll interval, skipping ahead' % -delay)
+            metrics.inc('poll_overruns_total')
+            next_poll = loop.time()
+            delay = 0
+        await asyncio.sleep(delay)
 
 loop = asyncio.get_event_loop()
 
+WRITER = results.ResultWriter(args.output, args.output_format == 'binary',
+                              flush_interval=args.flush_interval, flush_rows=args.flush_rows,
+                              rotate_size=ftcache.parse_size(args.rotate_size), rotate_interval=args.rotate_interval)
+WRITER.start()
+# including on SystemExit at the end of stdin
+atexit.register(WRITER.close)
+
+# one client for the whole run, so probes share keep-alive connections
+CLIENT = ftapi.AsyncFTClient(cache=args.cache, cache_errors=False, limit=args.concurrency,
+                             host_override=args.host_override)
+
+# and one scheduler, which runs at most args.concurrency probes at a time
+SCHEDULER = probes.ProbeScheduler(workers=args.concurrency)
+SCHEDULER.start()
+# the writer's task is stopped with the scheduler's, and what it has left
+# is written by WRITER.close at exit
+SCHEDULER.tasks.append(WRITER.task)
+LAG = probes.LagMonitor()
+SCHEDULER.tasks.append(loop.create_task(LAG.run()))
+if args.stats_interval:
+    SCHEDULER.tasks.append(loop.create_task(report_stats(args.stats_interval)))
+if args.stats_file:
+    atexit.register(write_stats, args.stats_file)
+
+def sample_metrics():
+    for name, value in SCHEDULER.stats().items():
+        metrics.set_gauge('scheduler_' + name, value)
+    for name, value in LAG.stats().items():
+        if value is not None:
+            metrics.set_gauge('event_loop_' + name, value)
+    metrics.set_gauge('results_waiting', len(WRITER.rows))
+
+# metrics are only kept if they will be seen
+if args.metrics_listen or args.metrics_file:
+    metrics.enable()
+    metrics.add_collector(sample_metrics)
+if args.metrics_listen:
+    METRICS_SERVER = loop.run_until_complete(metrics.serve(args.metrics_listen))
+if args.metrics_file:
+    SCHEDULER.tasks.append(loop.create_task(metrics.write_snapshots(args.metrics_file, args.metrics_interval)))
+    atexit.register(metrics.write_snapshot, args.metrics_file)
+
+# with --adaptive, what each endpoint has taken to return uuids so far
+MODEL = None
+if args.adaptive:
+    MODEL = probes.LatencyModel(quantile=args.adaptive_quantile)
+    if args.latency_model:
+        MODEL.load(args.latency_model)
+        atexit.register(MODEL.save, args.latency_model)
+
 if args.articles or args.article_stats:
     logging.info("Collecting articles from %s" % ARTICLE_URL_KEYS)
     article_apis = ARTICLE_URL_KEYS
@@ -332,9 +528,14 @@ if args.stdin:
     loop.run_until_complete(collect_stdin(article_apis, args.article_stats, args.since,
                                           feed_apis, args.feed_stats,
                                           args.cache, args.key, args.cookie))
+    loop.run_until_complete(SCHEDULER.stop())
+    CLIENT.close()
     loop.close()
 else:
-    loop.run_until_complete(collect_main(args.apis, args.since, args.repeat, article_apis, args.article_stats, args.cache, args.key, args.cookie))
+    loop.run_until_complete(collect_main(args.apis, args.since, args.repeat, article_apis, args.article_stats,
+                                         article_cache=args.cache, key=args.key, cookie=args.cookie))
+    loop.run_until_complete(SCHEDULER.stop())
+    CLIENT.close()
     loop.close()
 
 
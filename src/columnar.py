@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+#coding: utf-8
+
+import json
+import mmap
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# A file is a sequence of chunks, so that it can be appended to as results
+# arrive. Each chunk is
+#
+#   MAGIC, <uint32 header length>, <JSON header>, <column data>
+#
+# where the header lists the row count and, for each column, its name, type,
+# byte offset and length within the column data (aligned to 8 bytes).
+# Column types are
+#
+#   i8    int64, e.g. timestamps in microseconds since the epoch
+#   f8    float64, e.g. intervals in seconds
+#   dict  uint32 codes into a list of strings held in the header
+#
+# Column data is little-endian and is read straight from a memory map.
+
+MAGIC = b'FTC1'
+ALIGN = 8
+
+ARRAY_TYPES = { 'i8': ('q', '<i8'),
+                'f8': ('d', '<f8'),
+                'dict': ('I', '<u4') }
+
+# <time>,<url_name>,<uuid>,<status>[,<latency>] as written by collect.py,
+# with latency in microseconds or -1 if there is none
+COLLECT_SCHEMA = [('time', 'i8'), ('source', 'dict'), ('uuid', 'dict'), ('status', 'dict'), ('latency', 'i8')]
+
+# <uuid>,<source>,<origin>,<interval>,<status>,<title> as written by analyse.py
+ANALYSE_SCHEMA = [('uuid', 'dict'), ('source', 'dict'), ('origin', 'dict'), ('interval', 'f8'),
+                  ('status', 'dict'), ('title', 'dict')]
+
+def is_columnar(filename):
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class ColumnWriter:
+    def __init__(self, out, schema, chunk_size=65536):
+        self.out = out
+        self.schema = schema
+        self.chunk_size = chunk_size
+        self.rows = []
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.out.write(encode_chunk(self.schema, self.rows))
+            self.rows = []
+        self.out.flush()
+
+    def close(self):
+        self.flush()
+
+
+def encode_chunk(schema, rows):
+    columns = []
+    data = []
+    offset = 0
+    for i, (name, kind) in enumerate(schema):
+        values = [row[i] for row in rows]
+        column = {'name': name, 'type': kind}
+        if kind == 'dict':
+            codes = {}
+            values = [codes.setdefault(value, len(codes)) for value in values]
+            column['dictionary'] = sorted(codes, key=codes.get)
+        typecode = ARRAY_TYPES[kind][0]
+        encoded = struct.pack('<%d%s' % (len(values), typecode), *values)
+        encoded += b'\0' * (-len(encoded) % ALIGN)
+        column['offset'] = offset
+        column['length'] = len(values)
+        offset += len(encoded)
+        columns.append(column)
+        data.append(encoded)
+
+    header = json.dumps({'rows': len(rows), 'columns': columns}).encode('utf-8')
+    # pad so the column data starts on an aligned offset in the file
+    header += b' ' * (-(len(MAGIC) + 4 + len(header)) % ALIGN)
+    return MAGIC + struct.pack('<I', len(header)) + header + b''.join(data)
+
+
+def read_chunks(filename):
+    # yields {name: column} per chunk; columns are numpy arrays if numpy is
+    # available, memoryviews otherwise, and dict columns are (codes, dictionary)
+    with open(filename, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return # empty file
+    view = memoryview(mm)
+    position = 0
+    while position < len(mm):
+        if mm[position:position+len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not a columnar file (bad chunk at byte %d)' % (filename, position))
+        header_length, = struct.unpack_from('<I', mm, position+len(MAGIC))
+        header_start = position + len(MAGIC) + 4
+        data_start = header_start + header_length
+        header = json.loads(mm[header_start:data_start].decode('utf-8'))
+
+        chunk = {}
+        end = data_start
+        for column in header['columns']:
+            typecode, dtype = ARRAY_TYPES[column['type']]
+            start = data_start + column['offset']
+            size = struct.calcsize(typecode) * column['length']
+            if numpy:
+                values = numpy.frombuffer(mm, dtype=dtype, count=column['length'], offset=start)
+            else:
+                values = view[start:start+size].cast(typecode)
+            if column['type'] == 'dict':
+                values = (values, column['dictionary'])
+            chunk[column['name']] = values
+            end = max(end, start + size + (-size % ALIGN))
+        yield chunk
+        position = end
+
+def read_rows(filename, schema):
+    # yields tuples in schema order, decoding dict columns; columns missing
+    # from older files are None
+    names = [name for name, kind in schema]
+    for chunk in read_chunks(filename):
+        columns = []
+        for name in names:
+            values = chunk.get(name)
+            if isinstance(values, tuple):
+                codes, dictionary = values
+                values = [dictionary[code] for code in codes.tolist()]
+            elif values is not None:
+                values = values.tolist()
+            columns.append(values)
+        rows = max(len(values) for values in columns if values is not None)
+        columns = [[None] * rows if values is None else values for values in columns]
+        for row in zip(*columns):
+            yield row
+
+def read_columns(filename, names):
+    # yields a tuple of the named columns per chunk, as read_chunks has
+    # them, without decoding dict columns or building rows; columns missing
+    # from older files are None
+    for chunk in read_chunks(filename):
+        yield tuple(chunk.get(name) for name in names)
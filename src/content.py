@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+#coding: utf-8
+
+import logging
+import json
+import sys
+import urllib.error
+import time
+import concurrent.futures
+import ftapi
+import metadata
+import timeparse
+
+UUID_LENGTH = 36
+
+class NotFound(ValueError):
+    pass
+
+class NoResponse(ValueError):
+    pass
+
+class Item:
+    # only the fields that are used are kept, not the whole document, as
+    # there may be hundreds of thousands of these
+    __slots__ = ('_id', 'origin', 'type', 'title', 'published_ts')
+
+    # set by the script using it
+    KEY = None
+    CACHE = None
+    RATE_LIMITER = None
+    # without a metadata store, not found articles are remembered in the cache
+    CACHE_ERRORS = True
+
+    def __init__(self, id=None):
+        self._id = id
+        _json = Item.get_content(self._id)
+        obj = json.loads(_json)
+        self.origin = Item.sniff_origin(obj)
+        self.type = obj.get('type', None)
+        if self.type is not None:
+            self.type = sys.intern(self.type)
+        self.title = obj.get('title', None) or obj.get('description', None)
+        #logging.debug( json.dumps(obj, indent=4) )
+        self.published_ts = timeparse.parse_iso(obj['publishedDate'][:26])
+
+    @classmethod
+    def from_row(cls, id, origin, type, title, published_ts):
+        # as stored by MetadataStore, without fetching the article again
+        item = cls.__new__(cls)
+        item._id = id
+        item.origin = sys.intern(origin)
+        item.type = type and sys.intern(type)
+        item.title = title
+        item.published_ts = published_ts
+        return item
+
+    def row(self):
+        return self.origin, self.type, self.title, self.published_ts
+
+    @staticmethod
+    def sniff_origin(obj):
+        if 'webUrl' in obj:
+            if 'www.ft.com/cms' in obj['webUrl']:
+                return 'METHODE'
+            elif 'blogs.ft.com/' in obj['webUrl']:
+                return 'BLOGS'
+            elif 'www.ft.com/fastft' in obj['webUrl']:
+                return 'FASTFT'
+        return 'UNKNOWN'
+
+    def __hash__(self):
+        return id(self)
+                
+    def __str__(self):
+        return '<%s %s "%s">' % (self.origin, Item.str_type(self.type), self.title)
+                   
+    CONTENT_URL = "http://api.ft.com/content"
+    ONTOLOGY_URL = "http://www.ft.com/ontology/content"
+
+    @staticmethod
+    def get_content(i_d):
+        i_d = i_d[-UUID_LENGTH:] # get rid of any http:// prefix
+        try:
+            content = ftapi.CachingFTURLopener(rate_limiter=Item.RATE_LIMITER,cache=Item.CACHE,cache_errors=Item.CACHE_ERRORS).get_url( Item.CONTENT_URL+"/"+i_d, key=Item.KEY)
+        except urllib.error.HTTPError as e:
+            raise NotFound('No content')
+        if not content:
+            raise NoResponse('No content')
+        return content
+
+    @staticmethod
+    def str_type(type):
+        if type.startswith(Item.ONTOLOGY_URL):
+            return type[len(Item.ONTOLOGY_URL)+1:]
+        else:
+            return type
+
+
+def resolve_item(uuid, store=None):
+    # the Item for uuid, or None if it is not content. With a store, the
+    # answer is looked up there first and recorded there once found, unless
+    # the article could not be fetched at all, so that it is tried again.
+    row = store and store.get(uuid)
+    if row:
+        return stored_item(uuid, row)
+
+    try:
+        item = Item(id=uuid)
+        logging.debug( 'Found %s' % item )
+        if store:
+            store.put(uuid, metadata.CONTENT, *item.row())
+        return item
+    except NotFound as e:
+        logging.debug(e)
+        logging.info('%s was not found' % uuid)
+        if store:
+            store.put(uuid, metadata.NOT_FOUND)
+    except ValueError as e:
+        logging.debug(e)
+        logging.info('%s was not content' % uuid)
+        if store and not isinstance(e, NoResponse):
+            store.put(uuid, metadata.NOT_CONTENT)
+    return None
+
+def stored_item(uuid, row):
+    status, origin, type, title, published_ts = row
+    if status == metadata.CONTENT:
+        return Item.from_row(uuid, origin, type, title, published_ts)
+    return None
+
+def resolve_items(ids, jobs=8, store=None):
+    # Fetch every distinct UUID up front, jobs at a time. Item.RATE_LIMITER
+    # spaces out the uncached requests, so this takes about as long as the
+    # rate limit allows rather than the sum of the round trips. Those already
+    # in the store are not fetched at all.
+    items = {}
+    ids = list(ids)
+    if store:
+        for uuid, row in store.get_many(ids).items():
+            items[uuid] = stored_item(uuid, row)
+        logging.info('Found %d/%d UUIDs in %s' % (len(items), len(ids), store.filename))
+        ids = [uuid for uuid in ids if uuid not in items]
+
+    start = last_report = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = dict((executor.submit(resolve_item, uuid, store), uuid) for uuid in ids)
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            items[futures[future]] = future.result()
+
+            now = time.time()
+            if now - last_report >= 10 or done == len(futures):
+                logging.info('Resolved %d/%d UUIDs in %.1fs (%.1f/s)' % (done, len(futures), now - start,
+                                                                       done / max(now - start, 0.001)))
+                last_report = now
+    if store:
+        store.commit()
+    return items
@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+#coding: utf-8
+
+import math
+
+# Cuts the points in a graph down to a fixed number before they are handed
+# to pygal, so that rendering time and SVG size stay the same however much
+# data there is. With max_points of 0 (or no more points than that) every
+# point is kept as it is.
+
+def density(points, max_points):
+    # Scatter points (x, y) binned on a grid of at most max_points cells
+    # over their range, as (x, y, count) for each cell with any points in
+    # it, at the mean of those points
+    points = list(points)
+    if not max_points or len(points) <= max_points:
+        return [(x, y, 1) for x, y in points]
+
+    side = max(int(math.sqrt(max_points)), 1)
+    min_x = min(x for x, y in points)
+    min_y = min(y for x, y in points)
+    width = (max(x for x, y in points) - min_x) / side or 1.0
+    height = (max(y for x, y in points) - min_y) / side or 1.0
+
+    cells = {}
+    for x, y in points:
+        cell = (min(int((x - min_x) / width), side - 1), min(int((y - min_y) / height), side - 1))
+        totals = cells.get(cell)
+        if totals is None:
+            totals = cells[cell] = [0.0, 0.0, 0]
+        totals[0] += x
+        totals[1] += y
+        totals[2] += 1
+    return [(sum_x / count, sum_y / count, count) for _, (sum_x, sum_y, count) in sorted(cells.items())]
+
+def line(points, max_points):
+    # A line through points (x, y), in order of x, without the vertices it
+    # would pass straight through anyway, and then if there are still more
+    # than max_points, only the first and last and the lowest and highest of
+    # those in each of max_points/4 equal ranges of x
+    points = list(points)
+    if not max_points or len(points) <= max_points:
+        return points
+
+    kept = points[:1]
+    for i in range(1, len(points) - 1):
+        (x0, y0), (x1, y1), (x2, y2) = kept[-1], points[i], points[i+1]
+        if (y1 - y0) * (x2 - x1) != (y2 - y1) * (x1 - x0):
+            kept.append(points[i])
+    kept.append(points[-1])
+    if len(kept) <= max_points:
+        return kept
+
+    ranges = max(max_points // 4, 1)
+    min_x = kept[0][0]
+    width = (kept[-1][0] - min_x) / ranges or 1.0
+    by_range = {}
+    for i, (x, y) in enumerate(kept):
+        by_range.setdefault(min(int((x - min_x) / width), ranges - 1), []).append(i)
+    reduced = set()
+    for indices in by_range.values():
+        reduced.update((indices[0], indices[-1],
+                        min(indices, key=lambda i: kept[i][1]),
+                        max(indices, key=lambda i: kept[i][1])))
+    return [kept[i] for i in sorted(reduced)]
@@ -1,31 +1,66 @@
 #!/usr/bin/python3
 #coding: utf-8
 
-import urllib.request, urllib.response, urllib.error
-import os
-import re
+import urllib.request, urllib.response, urllib.error, urllib.parse
 import time
 import logging
+import asyncio
+import threading
+import ftcache
+import metrics
+
+def cache_lookup(cache, full_url):
+    # returns (hit, response), raising HTTPError again for a cached 404
+    hit = cache.get(full_url)
+    if hit is None:
+        return False, None
+    status, body = hit
+    if status == 200:
+        logging.info('Cache hit: %s',full_url)
+        return True, body.decode('utf-8')
+    logging.info('Cache hit (%s): %s',status,full_url)
+    if status == 404:
+        raise urllib.error.HTTPError(full_url, status, 'Not Found (cached)', {}, None)
+    return True, None
+
+class TokenBucket:
+    # Allows rate acquisitions per second on average, in bursts of up to
+    # burst, across any number of threads. A rate of 0 means no limit.
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate or 0)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last)*self.rate)
+            self.last = now
+            # take the token now, even if it has to be waited for, so that
+            # waiting threads queue up behind each other
+            self.tokens -= 1
+            wait = -self.tokens/self.rate
+        if wait > 0:
+            time.sleep(wait)
+
 
 class CachingFTURLopener(urllib.request.FancyURLopener):
     def __init__(self, *args, **kwargs):
         if 'cache' in kwargs and kwargs['cache']:
-            self.cache = True
-            self.cache_dir = kwargs.pop('cache')
+            self.cache = ftcache.open_cache(kwargs.pop('cache'))
         else:
-            self.cache = False
-            self.cache_dir = None
+            kwargs.pop('cache', None)
+            self.cache = None
 
-        if 'cache_errors' in kwargs:
-            # Write an empty file to cache if an error is encountered
-            self.cache_errors = kwargs['cache_errors']
-        else:
-            self.cache_errors = False
+        # Record a negative cache entry if an error is encountered
+        self.cache_errors = kwargs.pop('cache_errors', False)
 
-        if 'throttle' in kwargs:
-            self.throttle = kwargs['throttle']
-        else:
-            self.throttle = 0
+        self.throttle = kwargs.pop('throttle', 0)
+        self.rate_limiter = kwargs.pop('rate_limiter', None)
 
         urllib.request.FancyURLopener.__init__(self, *args, **kwargs)
 
@@ -39,27 +74,29 @@ class CachingFTURLopener(urllib.request.FancyURLopener):
             logging.warn('Got unexpected HTTP error %s %s' % (errcode,errmsg))
 
     def get_url(self, full_url, *args, **kwargs):
-        if self.cache and self.cache_dir:
-            cache_filename = os.path.join(os.path.expanduser(self.cache_dir),re.sub('[^0-9a-zA-Z]','_',full_url))
-            try:
-                response = open(cache_filename,'rb').read().decode('utf-8')
-                logging.info('Cache hit: %s',full_url)
+        if self.cache:
+            hit, response = cache_lookup(self.cache, full_url)
+            if hit:
                 return response
-            except FileNotFoundError:
-                cache_written = False
-                try:
-                    if self.throttle:
-                        time.sleep(self.throttle)
-                    response = self.get_url_force(full_url, *args, **kwargs)
-                    if response:
-                        logging.debug('Cache write: %s',full_url)
-                        open(cache_filename,'wb').write(response.encode('utf-8'))
-                        cache_written = True
-                        return response
-                finally:
-                    if self.cache_errors and not cache_written:
-                        open(cache_filename,'w').write('')
-                
+            status = 0
+            try:
+                if self.rate_limiter:
+                    self.rate_limiter.acquire()
+                elif self.throttle:
+                    time.sleep(self.throttle)
+                response = self.get_url_force(full_url, *args, **kwargs)
+                if response:
+                    logging.debug('Cache write: %s',full_url)
+                    self.cache.put(full_url, response.encode('utf-8'))
+                    status = 200
+                    return response
+            except urllib.error.HTTPError as e:
+                status = e.code
+                raise
+            finally:
+                if self.cache_errors and status != 200:
+                    self.cache.put(full_url, None, status)
+
         else:
             return self.get_url_force(full_url, *args, **kwargs)
 
@@ -92,3 +129,213 @@ class CachingFTURLopener(urllib.request.FancyURLopener):
         except UnicodeDecodeError as e:
             logging.warn('Response was not in expected encoding %s' % expect_encoding)
             return None
+
+
+class AsyncFTClient:
+    # Non-blocking counterpart to CachingFTURLopener for use inside the event
+    # loop. Keeps idle HTTP/1.1 connections per host for reuse and caps the
+    # number of requests in flight.
+    #
+    # With host_override (e.g. http://127.0.0.1:8080), every request goes to
+    # that server instead, with the host it was for as the first part of the
+    # path, as mockapi.py expects. Cache keys are still the real URLs, and
+    # connections are still pooled and limited per real host.
+    def __init__(self, cache=None, cache_errors=False, limit=20, limit_per_host=8, timeout=30, max_redirects=5,
+                 host_override=None):
+        self.cache = cache and ftcache.open_cache(cache)
+        self.host_override = host_override and host_override.rstrip('/')
+        self.cache_errors = cache_errors
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.user_agent = urllib.request.URLopener.version
+
+        self._slots = asyncio.Semaphore(limit)
+        self._host_slots = {}
+        self._idle = {}
+
+    async def get_url(self, full_url, *args, **kwargs):
+        if self.cache:
+            try:
+                hit, response = cache_lookup(self.cache, full_url)
+            except urllib.error.HTTPError:
+                metrics.inc('cache_lookups_total', result='hit')
+                raise
+            metrics.inc('cache_lookups_total', result=(hit and 'hit') or 'miss')
+            if hit:
+                return response
+            status = 0
+            try:
+                response = await self.get_url_force(full_url, *args, **kwargs)
+                if response:
+                    logging.debug('Cache write: %s',full_url)
+                    self.cache.put(full_url, response.encode('utf-8'))
+                    status = 200
+                    return response
+            except urllib.error.HTTPError as e:
+                status = e.code
+                raise
+            finally:
+                if self.cache_errors and status != 200:
+                    self.cache.put(full_url, None, status)
+        else:
+            response = await self.get_url_force(full_url, *args, **kwargs)
+            return response
+
+    async def get_url_force(self, full_url, key='', cookie='', with_next=False, expect_encoding='utf-8'):
+        logging.info('GET: %s %s %s %s',
+                     (key and 'key') or '   ', (with_next and 'next') or '    ', (cookie and 'cookie' or '      '),
+                     full_url)
+
+        headers = [('User-Agent', self.user_agent)]
+
+        if key:
+            logging.debug('X-Api-Key: %s', key)
+            headers.append(("X-Api-Key",key))
+
+        if with_next:
+            cookie = "FT_SITE=NEXT; " + cookie
+
+        if cookie:
+            logging.debug('Cookie: %s...', cookie[:40])
+            headers.append(("Cookie",cookie))
+
+        url = full_url
+        host = urllib.parse.urlsplit(full_url).hostname
+        started = time.monotonic()
+        try:
+            for _ in range(self.max_redirects+1):
+                status, reason, response_headers, response = await self._request(url, headers)
+                if status >= 300 and status < 400 and 'location' in response_headers:
+                    url = urllib.parse.urljoin(url, response_headers['location'])
+                else:
+                    break
+        except Exception as e:
+            logging.warning('API error: %s', e)
+            metrics.inc('http_requests_total', host=host, status='error')
+            return None
+        finally:
+            metrics.observe('http_request_seconds', time.monotonic() - started, host=host)
+        metrics.inc('http_requests_total', host=host, status=status)
+
+        if status == 404:
+            raise urllib.error.HTTPError(url, status, reason, response_headers, None)
+        elif status != 200:
+            # same outcome as CachingFTURLopener.http_error_default
+            if status < 300 or status >= 400:
+                logging.warning('Got unexpected HTTP error %s %s', status, reason)
+            logging.warning('API error: no content for %s (%s)', url, status)
+            return None
+
+        try:
+            return response.decode(expect_encoding)
+        except UnicodeDecodeError as e:
+            logging.warning('Response was not in expected encoding %s', expect_encoding)
+            return None
+
+    def close(self):
+        for connections in self._idle.values():
+            for reader, writer in connections:
+                writer.close()
+        self._idle = {}
+
+    async def _request(self, url, headers):
+        parts = urllib.parse.urlsplit(url)
+        pool_key = (parts.scheme, parts.hostname, parts.port or (parts.scheme == 'https' and 443) or 80)
+        if self.host_override:
+            parts = urllib.parse.urlsplit('%s/%s%s' % (self.host_override, parts.netloc, parts.path) +
+                                          (parts.query and '?' + parts.query or ''))
+        use_ssl = parts.scheme == 'https'
+        target = (parts.hostname, parts.port or (use_ssl and 443) or 80)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        if pool_key not in self._host_slots:
+            self._host_slots[pool_key] = asyncio.Semaphore(self.limit_per_host)
+        host_slots = self._host_slots[pool_key]
+
+        request = ['GET %s HTTP/1.1' % path, 'Host: %s' % parts.netloc, 'Accept-Encoding: identity']
+        request += ['%s: %s' % header for header in headers]
+        request = ('\r\n'.join(request) + '\r\n\r\n').encode('latin-1')
+
+        await self._slots.acquire()
+        try:
+            await host_slots.acquire()
+            try:
+                # a pooled connection may have been dropped by the server while
+                # idle, in which case retry once on a fresh one
+                for attempt in (0, 1):
+                    reader, writer, reused = await self._connect(pool_key, target, use_ssl)
+                    try:
+                        writer.write(request)
+                        status, reason, response_headers, body, keep_alive = \
+                            await asyncio.wait_for(self._read_response(reader), self.timeout)
+                    except (ConnectionError, asyncio.IncompleteReadError):
+                        writer.close()
+                        if reused and attempt == 0:
+                            continue
+                        raise
+                    except:
+                        writer.close()
+                        raise
+
+                    if keep_alive and len(self._idle.setdefault(pool_key, [])) < self.limit_per_host:
+                        self._idle[pool_key].append((reader, writer))
+                    else:
+                        writer.close()
+                    return status, reason, response_headers, body
+            finally:
+                host_slots.release()
+        finally:
+            self._slots.release()
+
+    async def _connect(self, pool_key, target, use_ssl):
+        idle = self._idle.get(pool_key)
+        while idle:
+            reader, writer = idle.pop()
+            if reader.at_eof() or reader.exception():
+                writer.close()
+            else:
+                return reader, writer, True
+        host, port = target
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port, ssl=use_ssl), self.timeout)
+        return reader, writer, False
+
+    async def _read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError('Connection closed before response')
+        version, status, reason = (status_line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+        status = int(status)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';', 1)[0].strip(), 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass # discard trailers
+                    break
+                chunks.append((await reader.readexactly(size)))
+                await reader.readexactly(2)
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        elif status < 200 or status in (204, 304):
+            body = b''
+        else:
+            body = await reader.read()
+            keep_alive = False
+
+        return status, reason, headers, body, keep_alive
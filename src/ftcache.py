@@ -0,0 +1,380 @@
+#!/usr/bin/python3
+#coding: utf-8
+
+import os
+import re
+import fcntl
+import contextlib
+import time
+import zlib
+import sqlite3
+import hashlib
+import atexit
+import logging
+import threading
+import collections
+import urllib.parse
+
+SIZE_SUFFIXES = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+
+def parse_size(size):
+    match = re.match(r'^([0-9.]+)\s*([KMGT]?)B?$', str(size).strip().upper())
+    if not match:
+        raise ValueError('Cannot understand size %s' % size)
+    return int(float(match.group(1)) * SIZE_SUFFIXES[match.group(2)])
+
+
+class ShardedCache:
+    # Responses are stored by sha1(url) as <dir>/ab/cd/abcd...; an append-only
+    # index records <digest> <status> <timestamp> <size> <url> for every write
+    # and is rewritten in least-recently-used order when it gets too long or
+    # the cache is closed. Error responses are kept in the index only, and
+    # expire after negative_ttl seconds.
+    #
+    # Several processes can share a cache: the index is only appended to or
+    # rewritten while holding an exclusive lock on the lock file, and each
+    # process reads what the others have appended before it writes, when it
+    # misses, and before it rewrites the index from everything in it.
+    INDEX = 'index'
+    LOCK = 'index.lock'
+
+    def __init__(self, cache_dir, max_size=0, max_entries=0, negative_ttl=86400):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_size = max_size and parse_size(max_size)
+        self.max_entries = int(max_entries)
+        self.negative_ttl = float(negative_ttl)
+
+        self.entries = collections.OrderedDict()
+        self.total_size = 0
+        # digests hit since the index was last rewritten, most recent last
+        self.touched = collections.OrderedDict()
+        self.lock = threading.RLock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.index_filename = os.path.join(self.cache_dir, ShardedCache.INDEX)
+        if not os.path.exists(self.index_filename) and \
+           any(not name.startswith('.') and os.path.isfile(os.path.join(self.cache_dir, name))
+               for name in os.listdir(self.cache_dir)):
+            logging.warn('%s looks like an old flat cache directory, use migrate_cache.py to convert it',
+                         self.cache_dir)
+        self.lock_file = open(os.path.join(self.cache_dir, ShardedCache.LOCK), 'a')
+        self.index = None
+        self.reader = None
+        self.index_inode = None
+        with self._index_lock(fcntl.LOCK_SH):
+            self._refresh()
+        logging.debug('Loaded %d cache entries (%d bytes) from %s', len(self.entries), self.total_size,
+                      self.index_filename)
+
+    @contextlib.contextmanager
+    def _index_lock(self, operation):
+        fcntl.flock(self.lock_file, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        # reads what has been added to the index since it was last read,
+        # or all of it if it has been rewritten; needs the index lock
+        try:
+            inode = os.stat(self.index_filename).st_ino
+        except FileNotFoundError:
+            inode = None
+        if inode is None or inode != self.index_inode:
+            if self.index:
+                self.index.close()
+                self.reader.close()
+            self.index = open(self.index_filename, 'ab')
+            self.reader = open(self.index_filename, 'rb')
+            self.index_inode = os.fstat(self.index.fileno()).st_ino
+            self.entries.clear()
+            self.total_size = 0
+            self.journal_length = 0
+
+        for line in self.reader:
+            if not line.endswith(b'\n'):
+                # cut short by a crash while writing it
+                self.reader.seek(-len(line), os.SEEK_CUR)
+                break
+            self.journal_length += 1
+            fields = line.decode('utf-8').rstrip('\n').split('\t', 4)
+            if len(fields) < 2:
+                continue
+            digest = fields[0]
+            if digest in self.entries:
+                self.total_size -= self.entries.pop(digest)[2]
+            if fields[1] != '-' and len(fields) == 5:
+                entry = [int(fields[1]), float(fields[2]), int(fields[3]), fields[4]]
+                self.entries[digest] = entry
+                self.total_size += entry[2]
+
+    def filename(self, digest):
+        return os.path.join(self.cache_dir, digest[:2], digest[2:4], digest)
+
+    def get(self, url):
+        # returns (status, body) or None; body is None for cached errors
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is None:
+                # another process may have put it since
+                with self._index_lock(fcntl.LOCK_SH):
+                    self._refresh()
+                entry = self.entries.get(digest)
+                if entry is None:
+                    return None
+            status = entry[0]
+            if status != 200:
+                if time.time() - entry[1] > self.negative_ttl:
+                    self._remove_now(digest)
+                    return None
+                self._touch(digest)
+                return status, None
+            try:
+                body = open(self.filename(digest), 'rb').read()
+            except FileNotFoundError:
+                logging.warn('Cache file for %s has gone missing', url)
+                self._remove_now(digest)
+                return None
+            self._touch(digest)
+            return status, body
+
+    def _touch(self, digest):
+        self.entries.move_to_end(digest)
+        self.touched[digest] = True
+        self.touched.move_to_end(digest)
+
+    def put(self, url, body, status=200, timestamp=None):
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        size = 0
+        with self.lock:
+            if status == 200:
+                filename = self.filename(digest)
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                tmp_filename = '%s.%d.%d.tmp' % (filename, os.getpid(), threading.get_ident())
+                open(tmp_filename, 'wb').write(body)
+                os.replace(tmp_filename, filename)
+                size = len(body)
+
+            with self._index_lock(fcntl.LOCK_EX):
+                self._refresh()
+                if digest in self.entries:
+                    self.total_size -= self.entries.pop(digest)[2]
+                entry = [status, timestamp or time.time(), size, url]
+                self.entries[digest] = entry
+                self.total_size += size
+                self._journal('%s\t%d\t%.6f\t%d\t%s\n' % (digest, status, entry[1], size, url))
+                self._evict()
+                if self.journal_length > 2*len(self.entries) + 1000:
+                    self._compact()
+
+    def _remove_now(self, digest):
+        with self._index_lock(fcntl.LOCK_EX):
+            self._refresh()
+            if digest in self.entries:
+                self._remove(digest)
+
+    def _remove(self, digest):
+        # needs the index lock held exclusively
+        status, timestamp, size, url = self.entries.pop(digest)
+        self.touched.pop(digest, None)
+        self.total_size -= size
+        if status == 200:
+            try:
+                os.unlink(self.filename(digest))
+            except FileNotFoundError:
+                pass
+        self._journal('%s\t-\n' % digest)
+
+    def _evict(self):
+        while self.entries and ((self.max_size and self.total_size > self.max_size) or
+                                (self.max_entries and len(self.entries) > self.max_entries)):
+            digest = next(iter(self.entries))
+            logging.debug('Cache evict: %s', self.entries[digest][3])
+            self._remove(digest)
+
+    def _journal(self, record):
+        # needs the index lock held exclusively, and the index read to the
+        # end, so that the record is the next thing in it
+        record = record.encode('utf-8')
+        self.index.write(record)
+        self.index.flush()
+        self.reader.seek(self.index.tell())
+        self.journal_length += 1
+
+    def compact(self):
+        with self.lock, self._index_lock(fcntl.LOCK_EX):
+            self._refresh()
+            self._compact()
+
+    def _compact(self):
+        # rewrites the index from everything in it, with entries this
+        # process has hit since it was last rewritten moved to the end
+        for digest in self.touched:
+            if digest in self.entries:
+                self.entries.move_to_end(digest)
+        self.touched.clear()
+        tmp_filename = '%s.%d.tmp' % (self.index_filename, os.getpid())
+        with open(tmp_filename, 'w') as index:
+            for digest, (status, timestamp, size, url) in self.entries.items():
+                index.write('%s\t%d\t%.6f\t%d\t%s\n' % (digest, status, timestamp, size, url))
+        os.replace(tmp_filename, self.index_filename)
+        self.index_inode = None
+        self._refresh()
+
+    def close(self):
+        with self.lock:
+            if self.index:
+                if self.touched:
+                    # persists the LRU order built up by hits
+                    self.compact()
+                self.index.close()
+                self.reader.close()
+                self.index = None
+            self.lock_file.close()
+
+
+class SQLiteCache:
+    # All responses in one SQLite file keyed by URL. Puts are kept in memory
+    # and written in one short transaction once there are batch_size of them,
+    # or commit_interval seconds after the first, so that the file is never
+    # locked for writing while this process is idle and other processes can
+    # share it; a write waits up to busy_timeout seconds for theirs. Bodies
+    # can be zlib-compressed.
+    def __init__(self, filename, compress=False, batch_size=100, commit_interval=5, negative_ttl=86400,
+                 busy_timeout=30):
+        self.filename = os.path.expanduser(filename)
+        self.compress = str(compress).lower() in ('1', 'true', 'yes', 'zlib')
+        self.batch_size = int(batch_size)
+        self.commit_interval = float(commit_interval)
+        self.negative_ttl = float(negative_ttl)
+
+        self.lock = threading.RLock()
+        # autocommit, with transactions only where writes are made
+        self.db = sqlite3.connect(self.filename, timeout=float(busy_timeout), isolation_level=None,
+                                  check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, status INTEGER, '
+                        'timestamp REAL, size INTEGER, compressed INTEGER, body BLOB)')
+        # url -> row to write, or None to delete it
+        self.pending = collections.OrderedDict()
+        self.timer = None
+
+    def get(self, url):
+        with self.lock:
+            if url in self.pending:
+                row = self.pending[url]
+                row = row and row[1:3] + row[4:]
+            else:
+                row = self.db.execute('SELECT status, timestamp, compressed, body FROM responses WHERE url = ?',
+                                      (url,)).fetchone()
+            if row is None:
+                return None
+            status, timestamp, compressed, body = row
+            if status != 200:
+                if time.time() - timestamp > self.negative_ttl:
+                    self.pending[url] = None
+                    self._written()
+                    return None
+                return status, None
+            if compressed:
+                body = zlib.decompress(body)
+            return status, bytes(body)
+
+    def put(self, url, body, status=200, timestamp=None):
+        size = 0
+        compressed = False
+        if status == 200:
+            size = len(body)
+            if self.compress:
+                body = zlib.compress(body)
+                compressed = True
+        else:
+            body = None
+        with self.lock:
+            self.pending[url] = (url, status, timestamp or time.time(), size, compressed, body)
+            self.pending.move_to_end(url)
+            self._written()
+
+    def _written(self):
+        if len(self.pending) >= self.batch_size:
+            self.commit()
+        elif self.timer is None:
+            self.timer = threading.Timer(self.commit_interval, self.commit)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def commit(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.pending or self.db is None:
+                return
+            try:
+                self.db.execute('BEGIN IMMEDIATE')
+                try:
+                    self.db.executemany('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                                        [row for row in self.pending.values() if row is not None])
+                    self.db.executemany('DELETE FROM responses WHERE url = ?',
+                                        [(url,) for url, row in self.pending.items() if row is None])
+                    self.db.execute('COMMIT')
+                except:
+                    self.db.execute('ROLLBACK')
+                    raise
+            except sqlite3.OperationalError as e:
+                # e.g. locked by another process for longer than busy_timeout;
+                # the writes are kept and tried again later
+                logging.warn('Could not write %d cache entries to %s: %s', len(self.pending), self.filename, e)
+                self.timer = threading.Timer(self.commit_interval, self.commit)
+                self.timer.daemon = True
+                self.timer.start()
+                return
+            logging.debug('Committed %d cache writes to %s', len(self.pending), self.filename)
+            self.pending.clear()
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.commit()
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+                if self.pending:
+                    logging.error('Lost %d cache writes to %s', len(self.pending), self.filename)
+                self.db.close()
+                self.db = None
+
+
+CACHE_SCHEMES = { 'dir': ShardedCache,
+                  'sqlite': SQLiteCache }
+
+_CACHES = {}
+# so that threads opening the same spec at once share one cache
+_CACHES_LOCK = threading.Lock()
+
+def open_cache(spec):
+    # spec is [scheme:]path[?option=value&...], where scheme is one of
+    # CACHE_SCHEMES (default dir) and the options are keyword arguments for
+    # that cache, e.g. cache/?max_size=2G or sqlite:cache.db?compress=zlib
+    if not isinstance(spec, str):
+        return spec
+    with _CACHES_LOCK:
+        if spec not in _CACHES:
+            path, _, query = spec.partition('?')
+            scheme, _, rest = path.partition(':')
+            if rest and scheme in CACHE_SCHEMES:
+                path = rest[2:] if rest.startswith('//') else rest
+            else:
+                scheme = 'dir'
+            options = dict(urllib.parse.parse_qsl(query))
+            _CACHES[spec] = CACHE_SCHEMES[scheme](path, **options)
+        return _CACHES[spec]
+
+@atexit.register
+def close_caches():
+    with _CACHES_LOCK:
+        for cache in _CACHES.values():
+            cache.close()
+        _CACHES.clear()
@@ -0,0 +1,298 @@
+#!/usr/bin/python3
+#coding: utf-8
+
+import logging
+import argparse
+import collections
+import concurrent.futures
+import csv
+import math
+import os
+import queue
+import sys
+import threading
+import time
+import ftapi
+import mentions
+import metadata
+import sketch
+import timeparse
+import content
+from content import Item
+
+# Follows collect.py's output as it is written and does what analyse.py and
+# bucket.py would do at the end, as it goes. Each observation goes into a
+# histogram for its <source>:<origin>:<status> (named as bucket.py names
+# them), and percentiles of each are reported every --interval seconds.
+#
+# Only a bounded number of uuids is remembered, least recently seen first
+# out, along with the observations waiting for their items; a uuid that is
+# forgotten before its item is fetched is not fetched at all. The histograms
+# grow with the log of the range of intervals, so memory stays flat however
+# long it runs, and however far behind fetching items falls.
+
+parser = argparse.ArgumentParser(description="Report latency percentiles live from the output of collect.py")
+
+parser.add_argument('csv', type=str, help='CSV file written by collect.py, or - for stdin')
+parser.add_argument('-F', '--follow', action='store_true', help='Keep reading the file as it grows (and after it is rotated), like tail -F')
+parser.add_argument('-b', '--base', type=str, help='Calculate intervals relative to which point', choices=['published_date', 'first_appearance', 'first_external_mention'], default='published_date')
+parser.add_argument('-m', '--mention-file', type=str, action='append', help='Log file to look for mentions, may be gzipped and given more than once (use with -b first_external_mention)')
+parser.add_argument('-M', '--mention-index', type=str, help='Save the first mention of each uuid to this file, and reuse it while the mention files are unchanged')
+parser.add_argument('-z', '--zeroes', action='store_true', help='Include results with zero interval (default: discard these)')
+parser.add_argument('-n', '--not-found', action='store_true', help='Include lines with 4xx status (default: exclude)')
+parser.add_argument('-i', '--interval', type=float, help='Seconds between reports (default: 60)', default=60)
+parser.add_argument('-q', '--quantiles', type=str, help='Quantiles to report (default: 0.5,0.9,0.99)', default='0.5,0.9,0.99')
+parser.add_argument('-t', '--table', type=str, help="Also rewrite bucket.py's table to this file at every report")
+parser.add_argument('-s', '--bucket-size', type=float, help='Bucket size in seconds for --table', default=5)
+parser.add_argument('-l', '--limit', type=int, help='Maximum number of buckets for --table (default:all)', default=0)
+parser.add_argument('-c', '--cumulative', action='store_true', help='Report accumulation of values in --table')
+parser.add_argument('-p', '--percentage', action='store_true', help='Report values in --table as a percentage of matching results')
+parser.add_argument('-u', '--max-uuids', type=int, help='Remember at most this many uuids (default: 100000)', default=100000)
+parser.add_argument('-r', '--rate', type=float, help='Maximum requests per second for uncached articles (default: 1)', default=1.0)
+parser.add_argument('-j', '--jobs', type=int, help='Number of articles to fetch concurrently (default: 8)', default=8)
+parser.add_argument('-k', '--key', type=str, help='FT API key (default: ~/.ft_api_key)', default=None)
+parser.add_argument('-C', '--cache', type=str, help='Cache for article responses: a directory, or sqlite:<file> for a single-file cache, optionally followed by ?<option>=<value>&...', default=None)
+parser.add_argument('-D', '--metadata', type=str, help='SQLite file to keep what each uuid resolved to in, so that its article is only fetched and parsed once', default=None)
+parser.add_argument('--debug', type=str, help='Set log level (default:WARN)', default=None)
+
+args = parser.parse_args()
+
+if args.debug:
+    logging.root.setLevel(getattr(logging,args.debug))
+else:
+    logging.root.setLevel(logging.WARN)
+
+if not args.key:
+    try:
+        args.key = open(os.path.expanduser('~/.ft_api_key'),'r').read().strip()
+    except IOError:
+        args.key = None
+
+if args.base == 'first_external_mention' and not args.mention_file:
+    parser.error('No file supplied for external mentions: expected -m <filename>')
+
+first_mentions = {}
+if args.mention_file:
+    first_mentions = mentions.first_mentions(args.mention_file, args.mention_index)
+
+Item.KEY = args.key
+Item.CACHE = args.cache
+Item.RATE_LIMITER = ftapi.TokenBucket(args.rate)
+
+METADATA = None
+if args.metadata:
+    METADATA = metadata.MetadataStore(args.metadata)
+    Item.CACHE_ERRORS = False
+
+QUANTILES = [float(q) for q in args.quantiles.split(',')]
+DAY = timeparse.DAY
+
+# lines read and items resolved, in the order they happened
+EVENTS = queue.Queue(maxsize=10000)
+
+
+def read_lines(f):
+    for line in f:
+        EVENTS.put(('line', line))
+    EVENTS.put(('end', None))
+
+def follow_lines(filename):
+    f = open(filename, 'r')
+    partial = ''
+    while True:
+        line = f.readline()
+        if line:
+            partial += line
+            if partial.endswith('\n'):
+                EVENTS.put(('line', partial))
+                partial = ''
+            continue
+        time.sleep(0.2)
+        try:
+            if os.stat(filename).st_ino != os.fstat(f.fileno()).st_ino:
+                logging.info('%s was rotated, reopening' % filename)
+                f.close()
+                f = open(filename, 'r')
+        except FileNotFoundError:
+            pass
+
+
+class Uuid:
+    # what is remembered about each uuid: its item once resolved (None if
+    # it isn't content), when it was first seen, the methods already counted
+    # for it, and observations waiting for the item
+    def __init__(self, first_when):
+        self.item = None
+        self.resolved = False
+        self.first_when = first_when
+        self.methods = set()
+        self.waiting = []
+
+UUIDS = collections.OrderedDict()
+EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs)
+# uuids waiting for their items to be resolved, oldest first, and how many
+# are being resolved; only --jobs are handed to the executor at a time, and
+# a uuid that is forgotten stops waiting, so neither grows past --max-uuids
+PENDING = collections.OrderedDict()
+RESOLVING = 0
+
+HISTOGRAMS = {}
+BUCKETS = {}
+TOTALS = {}
+
+def resolve(uuid):
+    EVENTS.put(('item', (uuid, content.resolve_item(uuid, METADATA))))
+
+def resolve_pending():
+    global RESOLVING
+    while PENDING and RESOLVING < args.jobs:
+        uuid, _ = PENDING.popitem(last=False)
+        RESOLVING += 1
+        EXECUTOR.submit(resolve, uuid)
+
+def see(when, src, uuid, status):
+    state = UUIDS.get(uuid)
+    if state is None:
+        state = UUIDS[uuid] = Uuid(when)
+        if len(UUIDS) > args.max_uuids:
+            forgotten, _ = UUIDS.popitem(last=False)
+            PENDING.pop(forgotten, None)
+        PENDING[uuid] = True
+        resolve_pending()
+    else:
+        UUIDS.move_to_end(uuid)
+
+    if state.resolved:
+        observe(uuid, state, when, src, status)
+    else:
+        state.waiting.append( (when, src, status) )
+
+def resolved(uuid, item):
+    global RESOLVING
+    RESOLVING -= 1
+    resolve_pending()
+    state = UUIDS.get(uuid)
+    if state is None:
+        return # forgotten while it was being resolved
+    state.item = item
+    state.resolved = True
+    for when, src, status in state.waiting:
+        observe(uuid, state, when, src, status)
+    state.waiting = []
+
+def observe(uuid, state, when, src, status):
+    # the same choices analyse.py and then bucket.py make for each line
+    item = state.item
+    if item is None or item.origin == 'UNKNOWN':
+        return
+
+    if args.base == 'first_appearance':
+        interval = when - state.first_when
+    elif args.base == 'first_external_mention':
+        if uuid not in first_mentions:
+            return
+        interval = when - first_mentions[uuid]
+    else:
+        interval = when - item.published_ts
+
+    if interval >= DAY or (interval == 0 and not args.zeroes):
+        return
+
+    # only the first result for each item+method counts
+    method = sys.intern('%s:%s:%s' % (src, item.origin, status))
+    if method in state.methods:
+        return
+    state.methods.add(method)
+
+    if status.startswith('4') and not args.not_found:
+        return
+
+    seconds = timeparse.interval_seconds(interval)
+    bucket = math.ceil( seconds / args.bucket_size )
+    if bucket < 0:
+        return
+
+    if method not in HISTOGRAMS:
+        HISTOGRAMS[method] = sketch.LogHistogram()
+        BUCKETS[method] = {}
+        TOTALS[method] = 0
+    HISTOGRAMS[method].add(seconds)
+    TOTALS[method] += 1
+    if not args.limit or bucket < args.limit:
+        BUCKETS[method][bucket] = BUCKETS[method].get(bucket, 0) + 1
+
+def report():
+    now = timeparse.format_iso(timeparse.now_us())
+    for method in sorted(HISTOGRAMS):
+        histogram = HISTOGRAMS[method]
+        print('%s,%s,%d,%s' % (now, method, histogram.count,
+                               ','.join('%.3f' % histogram.quantile(q) for q in QUANTILES)))
+    sys.stdout.flush()
+    logging.info('%d uuids remembered, %d being resolved and %d waiting to be' % (len(UUIDS), RESOLVING, len(PENDING)))
+
+    if args.table:
+        write_table(args.table)
+
+def write_table(filename):
+    # as bucket.py would write it
+    methods = sorted(HISTOGRAMS)
+    max_bucket = max([max(BUCKETS[method] or [0]) for method in methods] or [0])
+    limit = args.limit or max_bucket + 1
+
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as out:
+        out.write('time%s\n' % ''.join(',%s' % method for method in methods))
+        counts = [0] * len(methods)
+        for b in range(0, limit):
+            for i,method in enumerate(methods):
+                if args.cumulative:
+                    counts[i] += BUCKETS[method].get(b, 0)
+                else:
+                    counts[i] = BUCKETS[method].get(b, 0)
+            if args.percentage:
+                values = [str(count*100 / TOTALS[method]) for count, method in zip(counts, methods)]
+            else:
+                values = [str(count) for count in counts]
+            out.write('%s,%s\n' % (b*args.bucket_size, ','.join(values)))
+    os.replace(tmp_filename, filename)
+
+
+if args.csv == '-':
+    reader = threading.Thread(target=read_lines, args=(sys.stdin,), daemon=True)
+elif args.follow:
+    reader = threading.Thread(target=follow_lines, args=(args.csv,), daemon=True)
+else:
+    reader = threading.Thread(target=read_lines, args=(open(args.csv, 'r'),), daemon=True)
+reader.start()
+
+print('time,method,count,%s' % ','.join('p%g' % (q*100) for q in QUANTILES))
+
+ended = False
+next_report = time.time() + args.interval
+while not ended or RESOLVING:
+    try:
+        kind, value = EVENTS.get(timeout=max(next_report - time.time(), 0))
+    except queue.Empty:
+        report()
+        next_report += args.interval
+        continue
+
+    if kind == 'line':
+        line = next(csv.reader([value]), None)
+        if not line or len(line) < 4:
+            continue
+        try:
+            when = timeparse.parse_iso(line[0])
+        except ValueError:
+            logging.warn("Don't understand line %s" % value.strip())
+            continue
+        see(when, line[1], line[2], line[3])
+    elif kind == 'item':
+        resolved(*value)
+    else:
+        ended = True
+
+report()
+EXECUTOR.shutdown()
+if METADATA:
+    METADATA.close()
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+#coding: utf-8
+
+import logging
+import gzip
+import os
+import re
+import timeparse
+
+UUID_REGEX = re.compile('([0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12})')
+
+DATE_REGEX = re.compile('([0-9]{4}).([0-9]{2}).([0-9]{2}).([0-9]{2}).([0-9]{2}).([0-9]{2}).([0-9]+)')
+
+# Finds the earliest time each uuid is mentioned in publishing logs (as
+# fetched by get_pub.sh), reading each log once and keeping only
+# uuid -> earliest time in microseconds. The result can be saved as an index
+# file, which is reused for as long as the logs it came from are unchanged.
+
+def open_log(filename):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rt')
+    return open(filename, 'r')
+
+def line_time(line):
+    mention_time = DATE_REGEX.match(line.lstrip())
+    if not mention_time:
+        return None
+    return timeparse.to_us(int(mention_time.group(1)),
+                           int(mention_time.group(2)),
+                           int(mention_time.group(3)),
+                           int(mention_time.group(4)),
+                           int(mention_time.group(5)),
+                           int(mention_time.group(6)),
+                           int((mention_time.group(7)+'000000')[:6]))
+
+def index_mentions(filenames, first=None):
+    if first is None:
+        first = {}
+    for filename in filenames:
+        logging.info('Indexing mentions in %s' % filename)
+        for line in open_log(filename):
+            uuids = UUID_REGEX.findall(line)
+            if not uuids:
+                continue
+            this_time = line_time(line)
+            if this_time is None:
+                logging.debug("Don't understand line %s" % line.strip())
+                continue
+            for match in uuids:
+                uuid = match.lower()
+                if uuid not in first or this_time < first[uuid]:
+                    first[uuid] = this_time
+    return first
+
+def source_stamps(filenames):
+    return ['%s\t%d\t%d' % (os.path.abspath(filename), os.path.getsize(filename), os.path.getmtime(filename))
+            for filename in filenames]
+
+def load_index(index_filename, filenames):
+    # returns None if there is no index or it is out of date
+    try:
+        index = open(index_filename, 'r')
+    except FileNotFoundError:
+        return None
+    stamps = []
+    first = {}
+    for line in index:
+        if line.startswith('#'):
+            stamps.append(line[1:].strip('\n'))
+        else:
+            uuid, this_time = line.split('\t')
+            first[uuid] = int(this_time)
+    if stamps != source_stamps(filenames):
+        logging.info('Mention index %s is out of date' % index_filename)
+        return None
+    return first
+
+def save_index(index_filename, filenames, first):
+    tmp_filename = index_filename + '.tmp'
+    with open(tmp_filename, 'w') as index:
+        for stamp in source_stamps(filenames):
+            index.write('#%s\n' % stamp)
+        for uuid, this_time in first.items():
+            index.write('%s\t%d\n' % (uuid, this_time))
+    os.replace(tmp_filename, index_filename)
+
+def first_mentions(filenames, index_filename=None):
+    first = None
+    if index_filename:
+        first = load_index(index_filename, filenames)
+    if first is None:
+        first = index_mentions(filenames)
+        if index_filename:
+            save_index(index_filename, filenames, first)
+    logging.info('Found first mentions of %d uuids' % len(first))
+    return first
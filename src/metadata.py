@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+#coding: utf-8
+
+import logging
+import collections
+import os
+import sqlite3
+import threading
+import time
+
+# statuses of a uuid in the store
+CONTENT = 200
+NOT_CONTENT = 0
+NOT_FOUND = 404
+
+class MetadataStore:
+    # What each uuid resolved to, in one SQLite file: the fields of its Item
+    # once its article has been fetched and parsed, or just that it was not
+    # content or not found. Lookups never touch the article cache, so a
+    # rerun over uuids that were all resolved before reads only this.
+    #
+    # As with ftcache.SQLiteCache, puts are kept in memory and written in
+    # one short transaction per batch, so that the file is never locked for
+    # writing while this process is idle.
+    def __init__(self, filename, batch_size=1000, commit_interval=5, busy_timeout=30):
+        self.filename = os.path.expanduser(filename)
+        self.batch_size = int(batch_size)
+        self.commit_interval = float(commit_interval)
+
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(self.filename, timeout=float(busy_timeout), isolation_level=None,
+                                  check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS items (uuid TEXT PRIMARY KEY, status INTEGER, '
+                        'origin TEXT, type TEXT, title TEXT, published_ts INTEGER, timestamp REAL)')
+        # uuid -> row to write
+        self.pending = collections.OrderedDict()
+        self.timer = None
+
+    def get(self, uuid):
+        # (status, origin, type, title, published_ts), or None if unknown
+        with self.lock:
+            if uuid in self.pending:
+                return self.pending[uuid][1:6]
+            return self.db.execute('SELECT status, origin, type, title, published_ts FROM items WHERE uuid = ?',
+                                   (uuid,)).fetchone()
+
+    def get_many(self, uuids, chunk_size=500):
+        found = {}
+        uuids = list(uuids)
+        with self.lock:
+            for i in range(0, len(uuids), chunk_size):
+                chunk = uuids[i:i+chunk_size]
+                query = 'SELECT uuid, status, origin, type, title, published_ts FROM items WHERE uuid IN (%s)' % \
+                        ','.join('?' * len(chunk))
+                for row in self.db.execute(query, chunk):
+                    found[row[0]] = row[1:]
+            for uuid in uuids:
+                if uuid in self.pending:
+                    found[uuid] = self.pending[uuid][1:6]
+        return found
+
+    def put(self, uuid, status, origin=None, type=None, title=None, published_ts=None):
+        with self.lock:
+            self.pending[uuid] = (uuid, status, origin, type, title, published_ts, time.time())
+            self.pending.move_to_end(uuid)
+            self._written()
+
+    def _written(self):
+        if len(self.pending) >= self.batch_size:
+            self.commit()
+        elif self.timer is None:
+            self.timer = threading.Timer(self.commit_interval, self.commit)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def commit(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.pending or self.db is None:
+                return
+            try:
+                self.db.execute('BEGIN IMMEDIATE')
+                try:
+                    self.db.executemany('INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                        list(self.pending.values()))
+                    self.db.execute('COMMIT')
+                except:
+                    self.db.execute('ROLLBACK')
+                    raise
+            except sqlite3.OperationalError as e:
+                # e.g. locked by another process for longer than busy_timeout;
+                # the writes are kept and tried again later
+                logging.warn('Could not write %d metadata entries to %s: %s', len(self.pending), self.filename, e)
+                self.timer = threading.Timer(self.commit_interval, self.commit)
+                self.timer.daemon = True
+                self.timer.start()
+                return
+            logging.debug('Committed %d metadata writes to %s', len(self.pending), self.filename)
+            self.pending.clear()
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.commit()
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+                if self.pending:
+                    logging.error('Lost %d metadata writes to %s', len(self.pending), self.filename)
+                self.db.close()
+                self.db = None
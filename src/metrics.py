@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+#coding: utf-8
+
+import logging
+import asyncio
+import json
+import os
+import time
+import sketch
+import timeparse
+
+# Counters, gauges and latency histograms, each named and optionally
+# labelled, e.g. inc('http_requests_total', host='api.ft.com', status=200).
+# Nothing is kept until enable() is called, and until then every call
+# returns straight away, so they can be left in hot paths.
+#
+# What has been recorded can be scraped over HTTP (or a Unix socket) in the
+# Prometheus text format, or written to a file as JSON.
+
+PREFIX = 'collect_'
+QUANTILES = (0.5, 0.9, 0.99)
+
+REGISTRY = None
+
+
+class Registry:
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        # called before each snapshot, to set gauges from what they measure
+        self.collectors = []
+        self.started = time.time()
+
+def enable():
+    global REGISTRY
+    if REGISTRY is None:
+        REGISTRY = Registry()
+
+def enabled():
+    return REGISTRY is not None
+
+def _key(name, labels):
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+def inc(name, value=1, **labels):
+    if REGISTRY is None:
+        return
+    key = _key(name, labels)
+    REGISTRY.counters[key] = REGISTRY.counters.get(key, 0) + value
+
+def set_gauge(name, value, **labels):
+    if REGISTRY is None:
+        return
+    REGISTRY.gauges[_key(name, labels)] = value
+
+def observe(name, value, **labels):
+    if REGISTRY is None:
+        return
+    key = _key(name, labels)
+    histogram = REGISTRY.histograms.get(key)
+    if histogram is None:
+        histogram = REGISTRY.histograms[key] = sketch.LogHistogram()
+    histogram.add(value)
+
+def add_collector(collector):
+    if REGISTRY is None:
+        return
+    REGISTRY.collectors.append(collector)
+
+def _collect():
+    for collector in REGISTRY.collectors:
+        try:
+            collector()
+        except Exception:
+            logging.exception('Metrics collector %s failed' % collector)
+    set_gauge('uptime_seconds', time.time() - REGISTRY.started)
+
+
+def snapshot():
+    # everything recorded so far, as a dict that can be saved as JSON
+    _collect()
+
+    def entries(metrics, value):
+        return [dict(name=name, labels=dict(labels), **value(metric))
+                for (name, labels), metric in sorted(metrics.items())]
+
+    def summary(histogram):
+        return dict(count=histogram.count, sum=histogram.total, min=histogram.min, max=histogram.max,
+                    quantiles=dict(('%g' % q, histogram.quantile(q)) for q in QUANTILES))
+
+    return { 'time': timeparse.format_iso(timeparse.now_us()),
+             'counters': entries(REGISTRY.counters, lambda value: {'value': value}),
+             'gauges': entries(REGISTRY.gauges, lambda value: {'value': value}),
+             'histograms': entries(REGISTRY.histograms, summary) }
+
+def _labels(labels, **extra):
+    labels = list(labels) + sorted(extra.items())
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in labels)
+
+def render():
+    # the Prometheus text format, with histograms as summaries
+    _collect()
+    lines = []
+    for kind, metrics in (('counter', REGISTRY.counters), ('gauge', REGISTRY.gauges)):
+        typed = set()
+        for (name, labels), value in sorted(metrics.items()):
+            if name not in typed:
+                lines.append('# TYPE %s%s %s' % (PREFIX, name, kind))
+                typed.add(name)
+            lines.append('%s%s%s %s' % (PREFIX, name, _labels(labels), value))
+    typed = set()
+    for (name, labels), histogram in sorted(REGISTRY.histograms.items()):
+        if name not in typed:
+            lines.append('# TYPE %s%s summary' % (PREFIX, name))
+            typed.add(name)
+        for q in QUANTILES:
+            lines.append('%s%s%s %s' % (PREFIX, name, _labels(labels, quantile='%g' % q), histogram.quantile(q)))
+        lines.append('%s%s_sum%s %s' % (PREFIX, name, _labels(labels), histogram.total))
+        lines.append('%s%s_count%s %s' % (PREFIX, name, _labels(labels), histogram.count))
+    return '\n'.join(lines) + '\n'
+
+
+def write_snapshot(filename):
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as f:
+        json.dump(snapshot(), f, sort_keys=True)
+    os.replace(tmp_filename, filename)
+
+async def write_snapshots(filename, interval):
+    while True:
+        await asyncio.sleep(interval)
+        write_snapshot(filename)
+
+async def _handle(reader, writer):
+    # one request per connection: GET /metrics.json for the snapshot as
+    # JSON, anything else for the text format
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request_line.decode('latin-1').split()
+        if len(parts) > 1 and parts[1].startswith('/metrics.json'):
+            content_type, body = 'application/json', json.dumps(snapshot(), sort_keys=True)
+        else:
+            content_type, body = 'text/plain; version=0.0.4', render()
+        body = body.encode('utf-8')
+        writer.write(('HTTP/1.1 200 OK\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: close\r\n\r\n' %
+                      (content_type, len(body))).encode('latin-1') + body)
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def serve(address):
+    # address is [host:]port, or the path of a Unix socket, optionally
+    # given as unix:<path>
+    host, _, port = address.rpartition(':')
+    if address.startswith('unix:') or not port.isdigit():
+        path = address[5:] if address.startswith('unix:') else address
+        server = await asyncio.start_unix_server(_handle, path)
+    else:
+        server = await asyncio.start_server(_handle, host or '127.0.0.1', int(port))
+    logging.info('Serving metrics on %s' % address)
+    return server
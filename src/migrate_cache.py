@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+#coding: utf-8
+
+import logging
+import argparse
+import os
+import re
+import ftcache
+
+# URLs that get_url has cached; the old flat layout only kept the URL with
+# every non-alphanumeric character replaced by _, so it is recovered by
+# matching file names against these
+URL_TEMPLATES = [ 'http://api.ft.com/content/%s',
+                  'http://api.ft.com/content/items/v1/%s',
+                  'http://www.ft.com/cms/s/0/%s.html',
+                  'http://next.ft.com/%s' ]
+
+MANGLED_UUID = '([0-9A-Fa-f]{8}_[0-9A-Fa-f]{4}_[0-9A-Fa-f]{4}_[0-9A-Fa-f]{4}_[0-9A-Fa-f]{12})'
+
+def mangle(url):
+    return re.sub('[^0-9a-zA-Z]','_',url)
+
+def template_regex(template):
+    return re.compile('^' + MANGLED_UUID.join(re.escape(mangle(part)) for part in template.split('%s')) + '$')
+
+parser = argparse.ArgumentParser(description="Convert an old flat cache directory (one file per URL) into a new cache")
+
+parser.add_argument('old', type=str, help='Old cache directory')
+parser.add_argument('new', type=str, help='New cache (as given to -C)')
+parser.add_argument('-t', '--template', type=str, action='append', help='Extra URL template to recognise, with %%s for the uuid', default=[])
+parser.add_argument('-s', '--status', type=int, help='Status to record for empty (error) files (default: 404)', default=404)
+parser.add_argument('-d', '--delete', action='store_true', help='Delete old files once migrated')
+parser.add_argument('--debug', type=str, help='Set log level (default:WARN)', default=None)
+
+args = parser.parse_args()
+
+if args.debug:
+    logging.root.setLevel(getattr(logging,args.debug))
+else:
+    logging.root.setLevel(logging.WARN)
+
+templates = [(template, template_regex(template)) for template in URL_TEMPLATES + args.template]
+
+old_dir = os.path.expanduser(args.old)
+cache = ftcache.open_cache(args.new)
+
+migrated = 0
+skipped = 0
+
+for name in sorted(os.listdir(old_dir)):
+    filename = os.path.join(old_dir, name)
+    if not os.path.isfile(filename) or name == ftcache.ShardedCache.INDEX:
+        continue
+
+    for template, regex in templates:
+        match = regex.match(name)
+        if match:
+            url = template % match.group(1).replace('_','-')
+            break
+    else:
+        logging.info('No URL template matches %s, skipping', name)
+        skipped += 1
+        continue
+
+    body = open(filename,'rb').read()
+    if body:
+        cache.put(url, body, timestamp=os.path.getmtime(filename))
+    else:
+        # the old way of recording an error; starts a fresh negative_ttl
+        cache.put(url, None, args.status)
+    logging.debug('Migrated %s', url)
+    migrated += 1
+
+    if args.delete:
+        os.unlink(filename)
+
+ftcache.close_caches()
+
+print('Migrated %d entries, skipped %d' % (migrated, skipped))
@@ -0,0 +1,259 @@
+#!/usr/bin/python3
+#coding: utf-8
+
+import logging
+import argparse
+import asyncio
+import bisect
+import json
+import random
+import re
+import signal
+import sys
+import urllib.parse
+import timeparse
+
+# Imitates the FT endpoints collect.py polls and probes, for a synthetic run
+# of articles published at random at --rate per second: each turns up in
+# each notifications feed, and then each article endpoint starts to return
+# it rather than 404, after its own random delay. collect.py reaches it with
+# --host-override, which puts the real host at the start of each path.
+#
+# What was published when, and when each endpoint started to return it, is
+# written to --truth, so that what collect.py saw can be checked against it.
+
+parser = argparse.ArgumentParser(description="Serve imitations of the FT notifications and article endpoints used by collect.py, for benchmarking")
+
+parser.add_argument('-p', '--port', type=int, help='Port to listen on (default: 8080)', default=8080)
+parser.add_argument('-r', '--rate', type=float, help='Articles published per second, at random (default: 1)', default=1.0)
+parser.add_argument('-d', '--duration', type=float, help='Seconds to go on publishing for (default: 60)', default=60)
+parser.add_argument('-n', '--notification-delay', type=str, help='Seconds after publishing before an article is in the notifications, as <min>,<max> (default: 0,5)', default='0,5')
+parser.add_argument('-v', '--visibility-delay', type=str, action='append', help='Seconds after publishing before article endpoints stop returning 404, as <min>,<max>, or <endpoint>=<min>,<max> for one endpoint; may be given more than once (default: 0,30)', default=[])
+parser.add_argument('-f', '--flap', type=str, help='Fraction of articles that go back to 404 for a window of some seconds, one second after first appearing at an endpoint, as <fraction>,<seconds> (default: 0,0)', default='0,0')
+parser.add_argument('-t', '--response-time', type=str, help='Milliseconds to take over each response, as <min>,<max> (default: 20,200)', default='20,200')
+parser.add_argument('--page-size', type=int, help='Most notifications in one response, with a next link to the rest (default: 50)', default=50)
+parser.add_argument('-P', '--publish-log', action='store_true', help='Write a line with its uuid to stdout as each article is published, for collect.py -I')
+parser.add_argument('-T', '--truth', type=str, help='Write <uuid>,<endpoint>,<time> for when each article was published (endpoint PUBLISHED) and appeared at each endpoint to this file')
+parser.add_argument('-S', '--stats', type=str, help='Write counts of requests and responses by endpoint to this file as JSON on exit')
+parser.add_argument('-s', '--seed', type=int, help='Random seed (default: 1)', default=1)
+parser.add_argument('--debug', type=str, help='Set log level (default:WARN)', default=None)
+
+args = parser.parse_args()
+
+if args.debug:
+    logging.root.setLevel(getattr(logging,args.debug))
+else:
+    logging.root.setLevel(logging.WARN)
+
+def parse_range(value):
+    low, high = [float(x) for x in value.split(',')]
+    return low, high
+
+UUID = '([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})'
+
+NOTIFICATION_ROUTES = [ ('API-V2', re.compile('^/api[.]ft[.]com/content/notifications$')),
+                        ('API-V1', re.compile('^/api[.]ft[.]com/content/notifications/v1/items$')) ]
+
+ARTICLE_ROUTES = [ ('API-V1-ART', re.compile('^/api[.]ft[.]com/content/items/v1/%s$' % UUID)),
+                   ('API-V2-ART', re.compile('^/api[.]ft[.]com/content/%s$' % UUID)),
+                   ('WWW.FT.COM-ART', re.compile('^/www[.]ft[.]com/cms/s/0/%s[.]html$' % UUID)),
+                   ('NEXT.FT.COM-ART', re.compile('^/next[.]ft[.]com/%s$' % UUID)) ]
+
+WEB_URLS = [('METHODE', 'http://www.ft.com/cms/s/0/%s.html'),
+            ('BLOGS', 'http://blogs.ft.com/the-world/%s'),
+            ('FASTFT', 'http://www.ft.com/fastft/%s')]
+
+NOTIFICATION_DELAY = parse_range(args.notification_delay)
+VISIBILITY_DELAYS = dict((name, (0, 30)) for name, _ in ARTICLE_ROUTES)
+for value in args.visibility_delay:
+    if '=' in value:
+        name, value = value.split('=', 1)
+        if name not in VISIBILITY_DELAYS:
+            parser.error('No article endpoint %s: expected one of %s' % (name, sorted(VISIBILITY_DELAYS)))
+        VISIBILITY_DELAYS[name] = parse_range(value)
+    else:
+        for name in VISIBILITY_DELAYS:
+            VISIBILITY_DELAYS[name] = parse_range(value)
+FLAP_FRACTION, FLAP_SECONDS = parse_range(args.flap)
+RESPONSE_TIME = parse_range(args.response_time)
+
+STATUS_LINES = { 200: 'HTTP/1.1 200 OK', 400: 'HTTP/1.1 400 Bad Request', 404: 'HTTP/1.1 404 Not Found' }
+
+
+class Article:
+    # times are in microseconds since the epoch
+    def __init__(self, i, published):
+        self.uuid = '%08x-%04x-4%03x-8%03x-%012x' % (random.getrandbits(32), random.getrandbits(16), random.getrandbits(12),
+                                                     random.getrandbits(12), i)
+        self.published = published
+        self.origin, web_url = random.choice(WEB_URLS)
+        self.web_url = web_url % self.uuid
+        self.title = 'Synthetic article %d' % i
+        self.notified = dict((name, published + int(random.uniform(*NOTIFICATION_DELAY) * timeparse.SECOND))
+                             for name, _ in NOTIFICATION_ROUTES)
+        self.visible = dict((name, published + int(random.uniform(*VISIBILITY_DELAYS[name]) * timeparse.SECOND))
+                            for name, _ in ARTICLE_ROUTES)
+        self.flaps = {}
+        for name, visible in self.visible.items():
+            if random.random() < FLAP_FRACTION:
+                self.flaps[name] = (visible + timeparse.SECOND, visible + int((1 + FLAP_SECONDS) * timeparse.SECOND))
+
+    def found(self, name, now):
+        if now < self.visible[name]:
+            return False
+        if name in self.flaps:
+            start, end = self.flaps[name]
+            return not (start <= now < end)
+        return True
+
+    def body(self, name):
+        published = timeparse.format_iso(self.published)
+        if name == 'API-V2-ART':
+            return 'application/json', json.dumps({ 'id': 'http://www.ft.com/thing/%s' % self.uuid,
+                                                    'type': 'http://www.ft.com/ontology/content/Article',
+                                                    'title': self.title,
+                                                    'webUrl': self.web_url,
+                                                    'publishedDate': published })
+        elif name == 'API-V1-ART':
+            return 'application/json', json.dumps({ 'item': { 'id': self.uuid,
+                                                              'title': { 'title': self.title },
+                                                              'location': { 'uri': self.web_url },
+                                                              'lifecycle': { 'lastPublishDateTime': published } } })
+        else:
+            return 'text/html', '<html><head><title>%s</title></head><body></body></html>' % self.title
+
+
+def publish_articles(start):
+    articles = []
+    published = start
+    end = start + args.duration * timeparse.SECOND
+    while True:
+        published += int(random.expovariate(args.rate) * timeparse.SECOND)
+        if published >= end:
+            return articles
+        articles.append(Article(len(articles), published))
+
+random.seed(args.seed)
+START = timeparse.now_us() + timeparse.SECOND
+ARTICLES = publish_articles(START)
+BY_UUID = dict((article.uuid, article) for article in ARTICLES)
+
+# each feed's notifications in the order they turn up in it
+FEEDS = {}
+for name, _ in NOTIFICATION_ROUTES:
+    FEEDS[name] = sorted((article.notified[name], article.uuid) for article in ARTICLES)
+
+STATS = dict((name, {'requests': 0, '200': 0, '404': 0}) for name, _ in NOTIFICATION_ROUTES + ARTICLE_ROUTES)
+STATS['OTHER'] = {'requests': 0, '200': 0, '404': 0}
+
+logging.info('Publishing %d articles over %ss' % (len(ARTICLES), args.duration))
+
+if args.truth:
+    with open(args.truth, 'w') as truth:
+        for article in ARTICLES:
+            truth.write('%s,PUBLISHED,%s\n' % (article.uuid, timeparse.format_iso(article.published)))
+            for name, when in sorted(article.notified.items()) + sorted(article.visible.items()):
+                truth.write('%s,%s,%s\n' % (article.uuid, name, timeparse.format_iso(when)))
+
+
+def notifications(name, path, query, now):
+    # as the real feeds page through them: everything since the since
+    # parameter, page_size at a time, with a next link from the last one
+    try:
+        since = timeparse.parse_iso(urllib.parse.parse_qs(query).get('since', [''])[0])
+    except ValueError:
+        since = 0
+    feed = FEEDS[name]
+    found = feed[bisect.bisect_left(feed, (since, '')):bisect.bisect_right(feed, (now, 'g'))][:args.page_size]
+
+    if name == 'API-V2':
+        items = [{ 'type': 'http://www.ft.com/thing/ThingChangeEvent/UPDATE',
+                   'id': 'http://www.ft.com/thing/%s' % uuid,
+                   'apiUrl': 'http://api.ft.com/content/%s' % uuid,
+                   'lastModified': timeparse.format_iso(when) } for when, uuid in found]
+    else:
+        items = [{ 'type': 'CONTENT_PUBLISHED',
+                   'data': { 'content': { 'id': uuid, 'type': 'Content' } },
+                   'lastModified': timeparse.format_iso(when) } for when, uuid in found]
+
+    next_since = timeparse.format_iso((found and found[-1][0]) or since or now)
+    document = { 'requestUrl': 'http://%s?%s' % (path[1:], query),
+                 'notifications': items,
+                 'links': [{ 'href': 'http://%s?since=%s' % (path[1:], next_since), 'rel': 'next' }] }
+    return 200, 'application/json', json.dumps(document)
+
+def respond(path, query, now):
+    for name, route in NOTIFICATION_ROUTES:
+        if route.match(path):
+            return name, notifications(name, path, query, now)
+    for name, route in ARTICLE_ROUTES:
+        match = route.match(path)
+        if match:
+            article = BY_UUID.get(match.group(1))
+            if article is None or not article.found(name, now):
+                return name, (404, 'text/plain', 'Not Found')
+            return name, ((200,) + article.body(name))
+    return 'OTHER', (404, 'text/plain', 'Not Found')
+
+
+async def handle(reader, writer):
+    # HTTP/1.1 with keep-alive, which is all AsyncFTClient needs
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            keep_alive = True
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                header, _, value = line.decode('latin-1').partition(':')
+                if header.strip().lower() == 'connection' and value.strip().lower() == 'close':
+                    keep_alive = False
+
+            parts = request_line.decode('latin-1').split()
+            if len(parts) < 2:
+                status, content_type, body = 400, 'text/plain', 'Bad Request'
+                name = 'OTHER'
+            else:
+                url = urllib.parse.urlsplit(parts[1])
+                name, (status, content_type, body) = respond(url.path, url.query, timeparse.now_us())
+            STATS[name]['requests'] += 1
+            STATS[name][str(status)] = STATS[name].get(str(status), 0) + 1
+
+            await asyncio.sleep(random.uniform(*RESPONSE_TIME) / 1000.0)
+
+            body = body.encode('utf-8')
+            writer.write(('%s\r\nContent-Type: %s; charset=utf-8\r\nContent-Length: %d\r\n%s\r\n' %
+                          (STATUS_LINES[status], content_type, len(body),
+                           (not keep_alive and 'Connection: close\r\n') or '')).encode('latin-1') + body)
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def publish_log():
+    # what a publishing system's log would show, for collect.py -I
+    for article in ARTICLES:
+        await asyncio.sleep(max(article.published - timeparse.now_us(), 0) / timeparse.SECOND)
+        sys.stdout.write('%s published %s\n' % (timeparse.format_iso(article.published), article.uuid))
+        sys.stdout.flush()
+
+loop = asyncio.get_event_loop()
+server = loop.run_until_complete(asyncio.start_server(handle, '127.0.0.1', args.port))
+logging.info('Listening on http://127.0.0.1:%d' % args.port)
+
+if args.publish_log:
+    loop.create_task(publish_log())
+
+for signum in (signal.SIGINT, signal.SIGTERM):
+    loop.add_signal_handler(signum, loop.stop)
+loop.run_forever()
+
+server.close()
+if args.stats:
+    with open(args.stats, 'w') as f:
+        json.dump(STATS, f, sort_keys=True)
@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+#coding: utf-8
+
+import logging
+import collections
+import json
+import re
+import timeparse
+
+UUID_REGEX = re.compile('[0-9A-Fa-f]{8}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{12}')
+
+
+class SeenSet:
+    # Remembers keys for at most ttl seconds, and at most max_size of them,
+    # forgetting the least recently seen first (0 means no limit). Keys are
+    # kept in an OrderedDict in the order they were last seen, so both kinds
+    # of expiry only ever look at the oldest end.
+    def __init__(self, max_size=0, ttl=0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.seen = collections.OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.seen
+
+    def __len__(self):
+        return len(self.seen)
+
+    def add(self, key, now=None):
+        # returns True if the key was not already remembered
+        if now is None:
+            now = timeparse.now_us()
+        new = key not in self.seen
+        if not new:
+            self.seen.move_to_end(key)
+        self.seen[key] = now
+        self.expire(now)
+        return new
+
+    def expire(self, now=None):
+        if self.ttl:
+            if now is None:
+                now = timeparse.now_us()
+            oldest = now - self.ttl*timeparse.SECOND
+            while self.seen and next(iter(self.seen.values())) < oldest:
+                self.seen.popitem(last=False)
+        while self.max_size and len(self.seen) > self.max_size:
+            self.seen.popitem(last=False)
+
+
+def notification_uuid(notification):
+    # v2 notifications have an id of http://api.ft.com/thing(s)/<uuid>, v1
+    # ones have data.content.id
+    for value in (notification.get('id'),
+                  ((notification.get('data') or {}).get('content') or {}).get('id')):
+        if isinstance(value, str):
+            match = UUID_REGEX.search(value)
+            if match:
+                return match.group(0)
+    match = UUID_REGEX.search(json.dumps(notification))
+    return match and match.group(0)
+
+def notification_time(notification):
+    value = notification.get('lastModified') or notification.get('publishedDate')
+    if not value:
+        return None
+    try:
+        return timeparse.parse_iso(value)
+    except ValueError:
+        return None
+
+def parse(response):
+    # returns ([(uuid, last modified in us or None)], next link or None) from
+    # a notifications response, falling back to every uuid in it if it is not
+    # the JSON we expect
+    try:
+        document = json.loads(response)
+        notifications = document['notifications']
+    except (ValueError, KeyError, TypeError):
+        logging.debug('Not a notifications document, scanning for uuids')
+        return [(uuid, None) for uuid in UUID_REGEX.findall(response)], None
+
+    items = []
+    for notification in notifications:
+        if not isinstance(notification, dict):
+            continue
+        uuid = notification_uuid(notification)
+        if uuid:
+            items.append((uuid, notification_time(notification)))
+
+    next_link = None
+    for link in document.get('links') or []:
+        if link.get('rel') == 'next' and link.get('href'):
+            next_link = link['href']
+    return items, next_link
@@ -0,0 +1,20 @@
+#!/usr/bin/python3
+#coding: utf-8
+
+import resource
+import subprocess
+import time
+import sys
+
+# Runs a command and reports its wall time and peak resident memory on stderr
+
+if len(sys.argv) < 3:
+    raise SystemExit('Usage: %s <label> <command> [args...]' % sys.argv[0])
+
+start = time.time()
+returncode = subprocess.call(sys.argv[2:])
+elapsed = time.time() - start
+
+peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+sys.stderr.write('%s: %.1fs, peak RSS %.1f MB\n' % (sys.argv[1], elapsed, peak / 1024.0))
+sys.exit(returncode)
@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+#coding: utf-8
+
+import logging
+import asyncio
+import heapq
+import itertools
+import json
+import random
+import sketch
+
+
+class Backoff:
+    # Randomised exponential backoff in milliseconds: each wait is a random
+    # fraction of backoff, which then grows by rate. A probe that fails once
+    # backoff has passed give_up_time is the last.
+    #
+    # Given a start time (e.g. from a LatencyModel), the first probe waits
+    # until then, and backoff carries on from the value it would have reached
+    # on average by that time. Waits average half the backoff, so after n
+    # of them elapsed = backoff*(rate**n - 1)/(2*(rate - 1)), i.e. backoff
+    # has grown by 2*(rate - 1)*elapsed. Probes around the time of arrival
+    # are then as close together as they would have been without skipping
+    # the early ones.
+    def __init__(self, rate, backoff, give_up_time, start=0):
+        self.rate = rate
+        self.backoff = backoff
+        self.give_up_time = give_up_time
+        self.start = start
+
+    def first_wait(self, wait_time=0):
+        if self.start > wait_time:
+            self.backoff += 2*(self.rate - 1)*(self.start - wait_time)
+            return self.start
+        # if not told how long to wait, wait a random time
+        return wait_time or self.next_wait()
+
+    def next_wait(self):
+        wait_time = random.random()*self.backoff
+        self.backoff *= self.rate
+        return wait_time
+
+    def exhausted(self):
+        return self.backoff > self.give_up_time
+
+
+class LatencyModel:
+    # Learns, for each endpoint, how long (in ms) after a uuid is first seen
+    # the endpoint first returns it, and from that when to start probing:
+    # the given quantile of what has been seen so far. Until an endpoint has
+    # min_samples, and on a fraction explore of uuids after that, probing
+    # starts straight away so that the model still sees early arrivals.
+    def __init__(self, quantile=0.01, min_samples=20, explore=0.05):
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.explore = explore
+        self.histograms = {}
+
+    def observe(self, endpoint, elapsed):
+        if endpoint not in self.histograms:
+            self.histograms[endpoint] = sketch.LogHistogram()
+        self.histograms[endpoint].add(elapsed)
+
+    def start_time(self, endpoint):
+        histogram = self.histograms.get(endpoint)
+        if not histogram or histogram.count < self.min_samples or random.random() < self.explore:
+            return 0
+        return histogram.quantile(self.quantile)
+
+    def backoff(self, endpoint, rate, backoff, give_up_time):
+        return Backoff(rate, backoff, give_up_time, self.start_time(endpoint))
+
+    def load(self, filename):
+        try:
+            with open(filename, 'r') as f:
+                histograms = json.load(f)
+        except FileNotFoundError:
+            logging.info('No latency model in %s, starting afresh' % filename)
+            return
+        for endpoint, histogram in histograms.items():
+            self.histograms[endpoint] = sketch.LogHistogram.from_dict(histogram)
+        logging.info('Loaded latency model for %s from %s' % (sorted(self.histograms), filename))
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(dict((endpoint, histogram.to_dict()) for endpoint, histogram in self.histograms.items()),
+                      f, indent=1, sort_keys=True)
+
+
+class ProbeScheduler:
+    # Runs probes when they are due on a fixed pool of workers. Due probes
+    # are kept in a heap ordered by due time, and each is keyed (e.g. on
+    # uuid and endpoint) so that scheduling a key which is already queued or
+    # running does nothing.
+    #
+    # A probe is a coroutine function taking no arguments, which returns the
+    # number of seconds until it should run again, or None when it is done.
+    def __init__(self, workers=20):
+        self.workers = workers
+        self.loop = asyncio.get_event_loop()
+        self.heap = []
+        self.pending = set()
+        self.ready = asyncio.Queue()
+        self.wakeup = asyncio.Event()
+        self.sequence = itertools.count()
+        self.tasks = []
+
+        self.in_flight = 0
+        self.scheduled = 0
+        self.duplicates = 0
+        self.dispatched = 0
+        self.total_lateness = 0.0
+        self.max_lateness = 0.0
+
+    def start(self):
+        self.tasks.append(self.loop.create_task(self._timer()))
+        for _ in range(self.workers):
+            self.tasks.append(self.loop.create_task(self._worker()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def schedule(self, key, delay, probe):
+        if key in self.pending:
+            logging.debug('%s is already scheduled' % (key,))
+            self.duplicates += 1
+            return False
+        self.pending.add(key)
+        self.scheduled += 1
+        self._push(self.loop.time() + delay, key, probe)
+        return True
+
+    def _push(self, due, key, probe):
+        heapq.heappush(self.heap, (due, next(self.sequence), key, probe))
+        if self.heap[0][0] == due:
+            self.wakeup.set()
+
+    def stats(self):
+        return { 'queued': len(self.heap),
+                 'ready': self.ready.qsize(),
+                 'in_flight': self.in_flight,
+                 'scheduled': self.scheduled,
+                 'duplicates': self.duplicates,
+                 'dispatched': self.dispatched,
+                 'mean_lateness': self.total_lateness / max(self.dispatched, 1),
+                 'max_lateness': self.max_lateness }
+
+    async def _timer(self):
+        while True:
+            now = self.loop.time()
+            while self.heap and self.heap[0][0] <= now:
+                due, _, key, probe = heapq.heappop(self.heap)
+                self.ready.put_nowait((due, key, probe))
+
+            self.wakeup.clear()
+            timeout = None
+            if self.heap:
+                timeout = max(self.heap[0][0] - now, 0)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self):
+        while True:
+            due, key, probe = await self.ready.get()
+
+            lateness = self.loop.time() - due
+            self.dispatched += 1
+            self.total_lateness += lateness
+            self.max_lateness = max(self.max_lateness, lateness)
+
+            self.in_flight += 1
+            try:
+                delay = await probe()
+            except Exception:
+                logging.exception('Probe %s failed' % (key,))
+                delay = None
+            finally:
+                self.in_flight -= 1
+
+            if delay is None:
+                self.pending.discard(key)
+            else:
+                self._push(self.loop.time() + delay, key, probe)
+
+
+class LagMonitor:
+    # How late the event loop is: a task sleeps for interval seconds over and
+    # over, and how much longer than that each sleep took (in ms) goes into a
+    # histogram. Anything that blocks the loop delays every probe by as much.
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.loop = asyncio.get_event_loop()
+        self.histogram = sketch.LogHistogram()
+
+    async def run(self):
+        while True:
+            start = self.loop.time()
+            await asyncio.sleep(self.interval)
+            self.histogram.add(max(self.loop.time() - start - self.interval, 0) * 1000)
+
+    def stats(self):
+        return { 'lag_ms_p50': self.histogram.quantile(0.5),
+                 'lag_ms_p99': self.histogram.quantile(0.99),
+                 'lag_ms_max': self.histogram.max }
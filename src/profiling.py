@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+#coding: utf-8
+
+import atexit
+import collections
+import cProfile
+import sys
+import threading
+import time
+import tracemalloc
+
+# Where a script's time and memory go, by stage. Each stage is timed with
+# stage(), start() and stop(), timed() (for a function) or timed_iter() (for
+# each step of an iterator), and stages can nest: a stage's self time leaves
+# out the time spent in stages inside it. The memory each stage allocates
+# and does not free again is counted with tracemalloc.
+#
+# Until enable() is called, all of these do nothing (or return what they
+# were given), so they cost nothing in normal runs. Once enabled, a table of
+# the stages is written to stderr at exit, in the order they first started.
+# Stages in worker threads are timed on their own, so their times can add
+# up to more than the wall time.
+
+ENABLED = False
+STARTED = None
+PROFILER = None
+PROFILE_OUTPUT = None
+
+# name -> [calls, total seconds, self seconds, net bytes allocated]
+STAGES = collections.OrderedDict()
+_lock = threading.Lock()
+_local = threading.local()
+
+def enable(profile_output=None):
+    # with profile_output, the main thread is also run under cProfile and
+    # its statistics saved there for pstats
+    global ENABLED, STARTED, PROFILER, PROFILE_OUTPUT
+    ENABLED = True
+    STARTED = time.time()
+    tracemalloc.start()
+    if profile_output:
+        PROFILE_OUTPUT = profile_output
+        PROFILER = cProfile.Profile()
+        PROFILER.enable()
+    atexit.register(report)
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+def start(name):
+    if not ENABLED:
+        return
+    # [name, start time, time in stages inside it, traced memory at start]
+    _stack().append([name, time.perf_counter(), 0.0, tracemalloc.get_traced_memory()[0]])
+
+def stop():
+    if not ENABLED:
+        return
+    stack = _stack()
+    name, started, inside, memory = stack.pop()
+    elapsed = time.perf_counter() - started
+    allocated = tracemalloc.get_traced_memory()[0] - memory
+    if stack:
+        stack[-1][2] += elapsed
+    with _lock:
+        if name not in STAGES:
+            STAGES[name] = [0, 0.0, 0.0, 0]
+        totals = STAGES[name]
+        totals[0] += 1
+        totals[1] += elapsed
+        totals[2] += elapsed - inside
+        totals[3] += allocated
+
+class stage:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        start(self.name)
+
+    def __exit__(self, *exc):
+        stop()
+
+def timed(name, function):
+    if not ENABLED:
+        return function
+    def timed_function(*args, **kwargs):
+        start(name)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stop()
+    return timed_function
+
+def timed_iter(name, iterable):
+    if not ENABLED:
+        return iterable
+    return _timed_iter(name, iter(iterable))
+
+def _timed_iter(name, iterator):
+    while True:
+        start(name)
+        try:
+            value = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            stop()
+        yield value
+
+def report():
+    if PROFILER:
+        PROFILER.disable()
+        PROFILER.dump_stats(PROFILE_OUTPUT)
+
+    out = sys.stderr
+    out.write('%-24s %10s %10s %10s %14s\n' % ('stage', 'calls', 'total s', 'self s', 'net alloc MB'))
+    for name, (calls, total, own, allocated) in STAGES.items():
+        out.write('%-24s %10d %10.3f %10.3f %14.1f\n' % (name, calls, total, own, allocated / 1048576.0))
+    current, peak = tracemalloc.get_traced_memory()
+    out.write('wall %.3fs, peak traced memory %.1f MB\n' % (time.time() - STARTED, peak / 1048576.0))
+    if PROFILER:
+        out.write('cProfile statistics saved to %s\n' % PROFILE_OUTPUT)
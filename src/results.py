@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+#coding: utf-8
+
+import logging
+import asyncio
+import os
+import sys
+import time
+import columnar
+import timeparse
+
+
+class ResultWriter:
+    # Writes collect.py's rows, (<time>, <url_name>, <uuid>, <status>,
+    # <latency or None>) with times in microseconds, from a task of its own.
+    # write() only queues the row; rows are formatted and written in a batch
+    # once flush_rows are waiting or flush_interval seconds after the first
+    # of them was queued, so followers see every row within flush_interval.
+    #
+    # With a filename, the file is rotated (renamed with the time to the
+    # microsecond, never replacing another file, and a new one started) once
+    # it reaches rotate_size bytes or has been open for rotate_interval
+    # seconds. Without one, rows go to stdout.
+    def __init__(self, filename=None, binary=False, flush_interval=1.0, flush_rows=1000,
+                 rotate_size=0, rotate_interval=0):
+        self.filename = filename
+        self.binary = binary
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.rotate_size = rotate_size
+        self.rotate_interval = rotate_interval
+        self.loop = asyncio.get_event_loop()
+        self.rows = []
+        self.waiting = asyncio.Event()
+        self.full = asyncio.Event()
+        self.task = None
+        self.out = None
+        self.opened = None
+        self.written = 0
+
+    def start(self):
+        self.task = self.loop.create_task(self._run())
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) == 1:
+            self.waiting.set()
+        if len(self.rows) >= self.flush_rows:
+            self.full.set()
+
+    def flush(self):
+        rows = self.rows
+        self.rows = []
+        self.waiting.clear()
+        self.full.clear()
+        if rows:
+            self._write(rows)
+
+    def close(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        self.flush()
+        if self.out and self.filename:
+            self.out.close()
+            self.out = None
+
+    async def _run(self):
+        while True:
+            await self.waiting.wait()
+            try:
+                await asyncio.wait_for(self.full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.flush()
+
+    def _open(self):
+        if not self.filename:
+            self.out = (self.binary and sys.stdout.buffer) or sys.stdout
+        else:
+            self.out = open(self.filename, (self.binary and 'ab') or 'a')
+            self.written = self.out.tell()
+        self.opened = time.time()
+
+    def _rotate(self):
+        now = time.time()
+        stamp = '%s.%06d' % (time.strftime('%Y%m%dT%H%M%S', time.gmtime(now)), int(now % 1 * 1000000))
+        self.out.close()
+        # linking fails rather than replace a file that is already there, in
+        # which case a number is added to the name
+        rotated = '%s.%s' % (self.filename, stamp)
+        count = 0
+        while True:
+            try:
+                os.link(self.filename, rotated)
+                break
+            except FileExistsError:
+                count += 1
+                rotated = '%s.%s-%d' % (self.filename, stamp, count)
+        os.unlink(self.filename)
+        logging.info('Rotated %s to %s' % (self.filename, rotated))
+        self._open()
+
+    def _write(self, rows):
+        if not self.out:
+            self._open()
+        elif self.filename and ((self.rotate_size and self.written >= self.rotate_size) or
+                                (self.rotate_interval and time.time() - self.opened >= self.rotate_interval)):
+            self._rotate()
+
+        if self.binary:
+            data = columnar.encode_chunk(columnar.COLLECT_SCHEMA,
+                                         [(when, url_name, uuid, str(status), -1 if latency is None else latency)
+                                          for when, url_name, uuid, status, latency in rows])
+        else:
+            lines = []
+            for when, url_name, uuid, status, latency in rows:
+                if latency is None:
+                    lines.append('%s,%s,%s,%s\n' % (timeparse.format_iso(when), url_name, uuid, status))
+                else:
+                    lines.append('%s,%s,%s,%s,%s\n' % (timeparse.format_iso(when), url_name, uuid, status,
+                                                       timeparse.format_interval(latency)))
+            data = ''.join(lines)
+
+        self.out.write(data)
+        self.out.flush()
+        if self.filename:
+            # in bytes, however the rows were encoded
+            self.written = self.out.tell()
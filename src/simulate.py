@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+#coding: utf-8
+
+import logging
+import argparse
+import collections
+import csv
+import random
+import columnar
+import probes
+import timeparse
+
+# Replays a collection (as written by collect.py -I -A, e.g. exp3-1.csv) to
+# compare how many probes the randomised backoff and the adaptive schedule of
+# collect.py --adaptive would have made, and how long after each article
+# became available they would have noticed.
+#
+# For each uuid, the first row with status 0 is when it was seen, and for
+# each endpoint the article is taken to have arrived at a random time
+# between the last failed probe and the first 200. Endpoints which never
+# returned 200 are probed until the schedule gives up.
+
+parser = argparse.ArgumentParser(description='Compare probe schedules by replaying collected results')
+
+parser.add_argument('csv', type=str, nargs='+', help='Input files, as written by collect.py')
+parser.add_argument('-f', '--format', type=str, help='Input format, CSV or binary columnar from collect.py --output-format binary (default: csv)', choices=['csv', 'binary'], default='csv')
+parser.add_argument('-b', '--backoff-rate', type=float, help='Exponential backoff factor (default: 1.1, as collect.py)', default=1.1)
+parser.add_argument('-w', '--initial_wait', type=int, help='Maximum ms to wait before the first probe (default: 2000, as collect.py)', default=2000)
+parser.add_argument('--backoff', type=int, help='Initial backoff in ms (default: 250, as for articles)', default=250)
+parser.add_argument('--give-up-time', type=int, help='Give up once the backoff passes this many ms (default: 20000, as for articles)', default=20000)
+parser.add_argument('-q', '--adaptive-quantile', type=float, help='Start adaptive probing at this quantile of previous arrival times (default: 0.01)', default=0.01)
+parser.add_argument('--min-samples', type=int, help='Arrivals to see on an endpoint before probing it adaptively (default: 20)', default=20)
+parser.add_argument('--explore', type=float, help='Fraction of uuids probed from the start anyway (default: 0.05)', default=0.05)
+parser.add_argument('-m', '--latency-model', type=str, help='Save the learnt model to this file, for collect.py --adaptive --latency-model')
+parser.add_argument('-s', '--seed', type=int, help='Random seed (default: 1)', default=1)
+parser.add_argument('--debug', type=str, help='Set log level (default:WARN)', default=None)
+
+args = parser.parse_args()
+
+if args.debug:
+    logging.root.setLevel(getattr(logging,args.debug))
+else:
+    logging.root.setLevel(logging.WARN)
+
+random.seed(args.seed)
+
+def read_rows(filename):
+    if args.format == 'binary':
+        for row in columnar.read_rows(filename, columnar.COLLECT_SCHEMA):
+            yield row[:4]
+        return
+    for line in csv.reader( open( filename, 'r') ):
+        yield timeparse.parse_iso(line[0]), line[1], line[2], line[3]
+
+def read_arrivals(filenames):
+    # returns [(seen, uuid, endpoint, arrival in ms after seen, or None)] in the order seen
+    seen = {}
+    probed = collections.defaultdict(list)
+    for filename in filenames:
+        for when, src, uuid, status in read_rows(filename):
+            if str(status) == '0':
+                if uuid not in seen or when < seen[uuid]:
+                    seen[uuid] = when
+            else:
+                probed[uuid, src].append((when, str(status) == '200'))
+
+    arrivals = []
+    for (uuid, endpoint), results in probed.items():
+        if uuid not in seen:
+            continue
+        results.sort()
+        last_failed = seen[uuid]
+        arrival = None
+        for when, found in results:
+            if found:
+                arrival = (last_failed + random.random()*(when - last_failed) - seen[uuid]) / 1000.0
+                break
+            last_failed = when
+        arrivals.append((seen[uuid], uuid, endpoint, arrival))
+    arrivals.sort()
+    logging.info('Read %d uuid/endpoint pairs for %d uuids' % (len(arrivals), len(seen)))
+    return arrivals
+
+def probe(state, wait_time, arrival):
+    # returns (probes made, ms when it was found or None)
+    when = state.first_wait(wait_time)
+    probes_made = 1
+    while arrival is None or when < arrival:
+        if state.exhausted():
+            return probes_made, None
+        when += state.next_wait()
+        probes_made += 1
+    return probes_made, when
+
+def simulate(arrivals, model=None):
+    random.seed(args.seed)
+    requests = 0
+    found = 0
+    missed = 0
+    errors = []
+    for seen, uuid, endpoint, arrival in arrivals:
+        if model:
+            state = model.backoff(endpoint, args.backoff_rate, args.backoff, args.give_up_time)
+        else:
+            state = probes.Backoff(args.backoff_rate, args.backoff, args.give_up_time)
+        probes_made, when = probe(state, random.random()*args.initial_wait, arrival)
+        requests += probes_made
+        if when is not None:
+            found += 1
+            errors.append(when - arrival)
+            if model:
+                model.observe(endpoint, when)
+        elif arrival is not None:
+            missed += 1
+    return requests, found, missed, sorted(errors)
+
+def error_quantile(errors, q):
+    if not errors:
+        return float('nan')
+    return errors[int(q*(len(errors) - 1))]
+
+arrivals = read_arrivals(args.csv)
+model = probes.LatencyModel(quantile=args.adaptive_quantile, min_samples=args.min_samples, explore=args.explore)
+
+print('strategy,pairs,requests,requests_per_pair,found,missed,mean_error_ms,p50_error_ms,p90_error_ms,max_error_ms')
+for name, strategy_model in [('backoff', None), ('adaptive', model)]:
+    requests, found, missed, errors = simulate(arrivals, strategy_model)
+    print('%s,%d,%d,%.2f,%d,%d,%.1f,%.1f,%.1f,%.1f' % (name, len(arrivals), requests, requests / max(len(arrivals), 1),
+                                                     found, missed,
+                                                     (errors and sum(errors) / len(errors)) or 0.0,
+                                                     error_quantile(errors, 0.5), error_quantile(errors, 0.9),
+                                                     error_quantile(errors, 1)))
+
+if args.latency_model:
+    model.save(args.latency_model)
+    logging.info('Saved latency model to %s' % args.latency_model)
@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+#coding: utf-8
+
+import math
+
+
+class LogHistogram:
+    # Counts values in logarithmically sized buckets, so that quantiles are
+    # within a fixed relative error (accuracy) of the true value whatever the
+    # range, while the number of buckets only grows with the log of the
+    # range. Histograms with the same accuracy merge by adding counts, and
+    # can be saved as JSON with to_dict().
+    #
+    # Bucket i holds magnitudes in (gamma**(i-1), gamma**i], with negative
+    # values kept separately from positive ones and zeros counted apart.
+    def __init__(self, accuracy=0.01):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _index(self, magnitude):
+        return int(math.ceil(math.log(magnitude) / self.log_gamma))
+
+    def _value(self, index):
+        # the point in the bucket with the least relative error to either end
+        return 2 * self.gamma**index / (self.gamma + 1)
+
+    def add(self, value, count=1):
+        if value > 0:
+            index = self._index(value)
+            self.positive[index] = self.positive.get(index, 0) + count
+        elif value < 0:
+            index = self._index(-value)
+            self.negative[index] = self.negative.get(index, 0) + count
+        else:
+            self.zeros += count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if other.accuracy != self.accuracy:
+            raise ValueError('Cannot merge histograms with accuracy %s and %s' % (self.accuracy, other.accuracy))
+        for index, count in other.positive.items():
+            self.positive[index] = self.positive.get(index, 0) + count
+        for index, count in other.negative.items():
+            self.negative[index] = self.negative.get(index, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        return self
+
+    def buckets(self):
+        # yields (value, count) in increasing order of value
+        for index in sorted(self.negative, reverse=True):
+            yield -self._value(index), self.negative[index]
+        if self.zeros:
+            yield 0, self.zeros
+        for index in sorted(self.positive):
+            yield self._value(index), self.positive[index]
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for value, count in self.buckets():
+            seen += count
+            if seen > rank:
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def to_dict(self):
+        return { 'accuracy': self.accuracy,
+                 'count': self.count,
+                 'total': self.total,
+                 'min': self.min,
+                 'max': self.max,
+                 'zeros': self.zeros,
+                 'positive': dict((str(index), count) for index, count in self.positive.items()),
+                 'negative': dict((str(index), count) for index, count in self.negative.items()) }
+
+    @classmethod
+    def from_dict(cls, d):
+        histogram = cls(d['accuracy'])
+        histogram.count = d['count']
+        histogram.total = d['total']
+        histogram.min = d['min']
+        histogram.max = d['max']
+        histogram.zeros = d['zeros']
+        histogram.positive = dict((int(index), count) for index, count in d['positive'].items())
+        histogram.negative = dict((int(index), count) for index, count in d['negative'].items())
+        return histogram
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+#coding: utf-8
+
+import logging
+import argparse
+import datetime
+import random
+import json
+import sys
+import ftcache
+
+ARTICLE_URL_NAMES = ['WWW.FT.COM-ART', 'NEXT.FT.COM-ART', 'API-V1-ART', 'API-V2-ART']
+
+WEB_URLS = [('METHODE', 'http://www.ft.com/cms/s/0/%s.html'),
+            ('BLOGS', 'http://blogs.ft.com/the-world/%s'),
+            ('FASTFT', 'http://www.ft.com/fastft/%s')]
+
+CONTENT_URL = "http://api.ft.com/content"
+
+parser = argparse.ArgumentParser(description="Generate a synthetic collection in the form written by collect.py -I -A (or analyse.py with -a), for benchmarking")
+
+parser.add_argument('-n', '--rows', type=int, help='Number of rows to write (default: 1000000)', default=1000000)
+parser.add_argument('-u', '--uuids', type=int, help='Number of distinct uuids (default: rows/50)', default=None)
+parser.add_argument('-a', '--analysed', action='store_true', help='Write rows as analyse.py would rather than as collect.py would')
+parser.add_argument('-C', '--cache', type=str, help='Also write article metadata for each uuid to this cache, for analyse.py')
+parser.add_argument('-B', '--body-size', type=int, help='Pad each cached article with a body of this many characters, as real ones have (default: 0)', default=0)
+parser.add_argument('-s', '--seed', type=int, help='Random seed (default: 1)', default=1)
+parser.add_argument('--debug', type=str, help='Set log level (default:WARN)', default=None)
+
+args = parser.parse_args()
+
+if args.debug:
+    logging.root.setLevel(getattr(logging,args.debug))
+else:
+    logging.root.setLevel(logging.WARN)
+
+if not args.uuids:
+    args.uuids = max(1, args.rows // 50)
+
+random.seed(args.seed)
+
+cache = args.cache and ftcache.open_cache(args.cache)
+
+rows_per_uuid = args.rows / args.uuids
+start = datetime.datetime(2015, 7, 4)
+out = sys.stdout
+written = 0
+
+for i in range(args.uuids):
+    uuid = '%08x-%04x-4%03x-8%03x-%012x' % (random.getrandbits(32), random.getrandbits(16), random.getrandbits(12),
+                                            random.getrandbits(12), i)
+    published = start + datetime.timedelta(0, i * 60 + random.random())
+    origin, web_url = random.choice(WEB_URLS)
+    title = 'Synthetic article %d' % i
+
+    if cache:
+        article = { 'id': 'http://www.ft.com/thing/%s' % uuid,
+                    'type': 'http://www.ft.com/ontology/content/Article',
+                    'title': title,
+                    'webUrl': web_url % uuid,
+                    'publishedDate': published.strftime('%Y-%m-%dT%H:%M:%S.%f')[:23] + 'Z' }
+        if args.body_size:
+            article['bodyXML'] = '<body>%s</body>' % ('x' * args.body_size)
+        cache.put('%s/%s' % (CONTENT_URL, uuid), json.dumps(article).encode('utf-8'))
+
+    seen = published + datetime.timedelta(0, random.random() * 5)
+    n = int((i + 1) * rows_per_uuid) - int(i * rows_per_uuid)
+    for j in range(n):
+        if j == 0:
+            url_name, status, when = 'STDIN', '0', seen
+        else:
+            url_name = ARTICLE_URL_NAMES[j % len(ARTICLE_URL_NAMES)]
+            status = (j >= n - len(ARTICLE_URL_NAMES) and '200') or '404'
+            when = seen + datetime.timedelta(0, j * random.random())
+
+        if args.analysed:
+            interval = when - published
+            out.write('%s,%s,%s,%s,%s,"%s"\n' % (uuid, url_name, origin, interval, status, title))
+        else:
+            out.write('%s,%s,%s,%s\n' % (when.strftime("%Y-%m-%dT%H:%M:%S.%fZ"), url_name, uuid, status))
+        written += 1
+
+logging.info('Wrote %d rows for %d uuids', written, args.uuids)
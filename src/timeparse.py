@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+#coding: utf-8
+
+import datetime
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Times are carried around as integer microseconds since the epoch (UTC) and
+# intervals as integer microseconds, which avoids building datetimes and
+# timedeltas for every row. Timestamps are ISO 8601 with fixed offsets:
+#
+#   2015-07-04T09:00:00.123456Z
+#   0123456789012345678901234567
+
+SECOND = 1000000
+MINUTE = 60*SECOND
+HOUR = 60*MINUTE
+DAY = 24*HOUR
+
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+_days = {}
+_dates = {}
+
+def epoch_day(year, month, day):
+    key = (year, month, day)
+    if key not in _days:
+        _days[key] = datetime.date(year, month, day).toordinal() - EPOCH_ORDINAL
+    return _days[key]
+
+def to_us(year, month, day, hour=0, minute=0, second=0, microsecond=0):
+    return epoch_day(year, month, day)*DAY + hour*HOUR + minute*MINUTE + second*SECOND + microsecond
+
+def parse_iso(s):
+    # <date>T<time>[.<fraction>]Z, as written by collect.py and in publishedDate
+    if len(s) < 20 or s[4] != '-' or s[7] != '-' or s[10] != 'T' or s[13] != ':' or s[16] != ':':
+        raise ValueError('Not an ISO timestamp: %r' % s)
+    us = epoch_day(int(s[0:4]), int(s[5:7]), int(s[8:10]))*DAY + \
+         int(s[11:13])*HOUR + int(s[14:16])*MINUTE + int(s[17:19])*SECOND
+    if s[19] == '.':
+        fraction = s[20:].rstrip('Z')
+        us += int((fraction + '000000')[:6])
+    return us
+
+def format_iso(us):
+    day, us = divmod(us, DAY)
+    if day not in _dates:
+        _dates[day] = datetime.date.fromordinal(day + EPOCH_ORDINAL).strftime('%Y-%m-%dT')
+    hours, us = divmod(us, HOUR)
+    minutes, us = divmod(us, MINUTE)
+    seconds, us = divmod(us, SECOND)
+    return '%s%02d:%02d:%02d.%06dZ' % (_dates[day], hours, minutes, seconds, us)
+
+def now_us():
+    return int(time.time()*SECOND)
+
+def from_datetime(when):
+    return to_us(when.year, when.month, when.day, when.hour, when.minute, when.second, when.microsecond)
+
+def to_datetime(us):
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(0, 0, us)
+
+def format_interval(us):
+    # the same as str(datetime.timedelta(microseconds=us))
+    if us < 0 or us >= DAY:
+        return str(datetime.timedelta(0, 0, us))
+    hours, us = divmod(us, HOUR)
+    minutes, us = divmod(us, MINUTE)
+    seconds, us = divmod(us, SECOND)
+    if us:
+        return '%d:%02d:%02d.%06d' % (hours, minutes, seconds, us)
+    return '%d:%02d:%02d' % (hours, minutes, seconds)
+
+def parse_interval(s):
+    # [-]H:MM:SS[.ffffff] as written by analyse.py, to float seconds; None if
+    # it isn't one. The arithmetic matches what bucket.py has always done, so
+    # values sit in the same buckets.
+    sign = 1
+    if s.startswith('-'):
+        sign = -1
+        s = s[1:]
+    parts = s.split(':')
+    if len(parts) != 3:
+        return None
+    try:
+        return sign*(float(parts[2]) + int(parts[1])*60 + int(parts[0])*60*60)
+    except ValueError:
+        return None
+
+def interval_seconds(us):
+    # the float parse_interval(format_interval(us)) would give, without the
+    # round trip through a string
+    if us < 0:
+        return -interval_seconds(-us)
+    hours, us = divmod(us, HOUR)
+    minutes, us = divmod(us, MINUTE)
+    return us / SECOND + minutes*60 + hours*60*60
+
+
+# Batch versions. With numpy these work on whole arrays; without it they
+# fall back to the functions above.
+
+def parse_iso_many(strings):
+    if not numpy:
+        return [parse_iso(s) for s in strings]
+
+    strings = numpy.asarray(strings, dtype='S32')
+    if not len(strings):
+        return numpy.zeros(0, dtype=numpy.int64)
+    chars = strings.view(numpy.uint8).reshape(len(strings), -1).astype(numpy.int64)
+    digits = chars - ord('0')
+
+    def number(start, end):
+        value = numpy.zeros(len(strings), dtype=numpy.int64)
+        for i in range(start, end):
+            value = value*10 + digits[:, i]
+        return value
+
+    year, month, day = number(0, 4), number(5, 7), number(8, 10)
+
+    # days since the epoch for a proleptic Gregorian date (H. Hinnant)
+    year = year - (month <= 2)
+    era = year // 400
+    year_of_era = year - era*400
+    day_of_year = (153*(month + numpy.where(month > 2, -3, 9)) + 2)//5 + day - 1
+    day_of_era = year_of_era*365 + year_of_era//4 - year_of_era//100 + day_of_year
+    days = era*146097 + day_of_era - 719468
+
+    us = days*DAY + number(11, 13)*HOUR + number(14, 16)*MINUTE + number(17, 19)*SECOND
+
+    # fractions of up to six digits, terminated by Z or the end of the string
+    scale = SECOND // 10
+    in_fraction = chars[:, 19] == ord('.')
+    for i in range(20, 26):
+        if i >= chars.shape[1]:
+            break
+        is_digit = (digits[:, i] >= 0) & (digits[:, i] <= 9)
+        in_fraction = in_fraction & is_digit
+        us += numpy.where(in_fraction, digits[:, i]*scale, 0)
+        scale //= 10
+    return us
+
+def parse_interval_many(strings):
+    values = [parse_interval(s) for s in strings]
+    if numpy:
+        return numpy.array([numpy.nan if value is None else value for value in values], dtype=numpy.float64)
+    return values
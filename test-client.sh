@@ -0,0 +1,7 @@
+#!/bin/bash
+
+# Checks that AsyncFTClient runs probes concurrently up to its limits,
+# reuses connections and never blocks the event loop, against a local
+# stub server; exits non-zero if it doesn't
+
+src/check_client.py "$@"
@@ -0,0 +1,6 @@
+#!/bin/bash
+
+# Checks that collect.py -I adds under a millisecond of latency to lines
+# arriving through a pipe; exits non-zero if it doesn't
+
+src/check_stdin.py "$@"